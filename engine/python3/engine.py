@@ -22,11 +22,14 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
 import binascii
+from collections import namedtuple, OrderedDict
 import io
 import os
 from os import environ, path
+import re
 import signal
 import sys
+import time
 from gettext import dgettext
 
 from main import get_userhome
@@ -94,6 +97,15 @@ SEGMENT_IMMEDIATE       = 1 << 1
 
 CLIPBOARD_RECONVERT = list(range(1))
 
+# The common settings which are read on each key event or conversion.
+HotPrefs = namedtuple('HotPrefs', ['ten_key_mode',
+                                   'trigger_periods',
+                                   'behavior_on_period',
+                                   'show_lut_on_convert',
+                                   'behavior_on_select_candidate',
+                                   'update_interval',
+                                   'update_deadline'])
+
 LINK_DICT_EMBEDDED, \
 LINK_DICT_SINGLE = list(range(2))
 
@@ -115,6 +127,26 @@ for k, v in zip(['KEY_KP_Add', 'KEY_KP_Decimal', 'KEY_KP_Divide', 'KEY_KP_Enter'
                  'KEY_space', 'KEY_minus']):
     KP_Table[getattr(IBus, k)] = getattr(IBus, v)
 
+# Compile the keys of the replacement rule into one regex alternation
+# so that a string is scanned once. The longer keys are matched first.
+def _compile_replace_rule(rule):
+    if len(rule) == 0:
+        # The pattern never matches and the repl keeps the string.
+        return (re.compile('(?!)'), lambda m: m.group(0))
+    table = dict([(k, v[0]) for k, v in rule.items()])
+    keys = sorted(table.keys(), key=len, reverse=True)
+    return (re.compile('|'.join([re.escape(k) for k in keys])),
+            lambda m: table[m.group(0)])
+
+NORMALIZE_RULE = _compile_replace_rule(romaji_normalize_rule)
+UTF8_RULE = _compile_replace_rule(romaji_utf8_rule)
+
+# The max number of the candidates whose UTF-8 variants are cached.
+UTF8_CANDIDATE_CACHE_SIZE = 1024
+
+# The max number of the cached preedit attributes.
+ATTRS_CACHE_SIZE = 256
+
 class Engine(IBus.EngineSimple):
     __input_mode = None
     __typing_mode = None
@@ -124,8 +156,26 @@ class Engine(IBus.EngineSimple):
     __setup_pid = 0
     __prefs = None
     __keybind = {}
+    # The command functions of Engine.__keybind which are called with
+    # the engine so that the engine is not referred by the class.
+    __keybind_functions = {}
+    __keybind_functions_base = None
     __thumb = None
     __latin_with_shift = True
+    __hot_prefs = None
+    # Conversion results by (reading, segment mode, dict mode)
+    __convert_cache = OrderedDict()
+    # The UTF-8 variants of the candidates by the candidate text
+    __utf8_candidates = {}
+    # The preedit attributes by (length, highlighted range)
+    # and their contents by the attributes
+    __attrs_cache = {}
+    __attrs_keys = {}
+    __record_file = None
+    # The number of the preedit updates and the invalidations
+    # which are coalesced into them
+    __nr_updates = 0
+    __nr_coalesced_updates = 0
 
     def __init__(self, bus, object_path):
         super(Engine, self).__init__(engine_name="anthy",
@@ -137,11 +187,27 @@ class Engine(IBus.EngineSimple):
         if not self.__verify_anthy_journal_file():
             return
         Anthy.GContext.set_logger(0);
-        self.__context = Anthy.GContext()
-        self.__context.set_encoding(Anthy.UTF8_ENCODING)
+        self.__anthy_context = Anthy.GContext()
+        self.__anthy_context.set_encoding(Anthy.UTF8_ENCODING)
+        # The key of the reading which is not set to the anthy context yet
+        # after the conversion is restored from Engine.__convert_cache.
+        self.__context_reading = None
+        # The key of the reading whose conversion is kept in the anthy
+        # context without any changes.
+        self.__context_key = None
+        self.__context_candidates = None
+        self.__nr_candidates = 0
+        self.__nr_loaded_candidates = 0
 
         # init state
         self.__idle_id = 0
+        self.__deadline_id = 0
+        self.__last_update_time = 0
+        self.__thumb_timer_id = 0
+        # The monotonic time when the armed thumb shift timer expires.
+        self.__thumb_timer_deadline = 0
+        self.__thumb_on_timeout = None
+        self.__clear_last_updates()
         self.__prop_dict = {}
         self.__input_purpose = 0
         self.__has_input_purpose = False
@@ -162,7 +228,7 @@ class Engine(IBus.EngineSimple):
 #                                                   cursor_pos=0,
 #                                                   cursor_visible=True,
 #                                                   round=True)
-        size = self.__prefs.get_value('common', 'page-size')
+        size = self.__prefs.get_snapshot_value('common', 'page-size')
         self.__lookup_table = IBus.LookupTable.new(page_size=size,
                                                    cursor_pos=0,
                                                    cursor_visible=True,
@@ -185,6 +251,24 @@ class Engine(IBus.EngineSimple):
         self.__reset()
 
 
+    # The anthy context does not need set_string() again when it has not
+    # been used since the same reading was converted, e.g. the conversion
+    # is cancelled and converted again, and then committed.
+    def __get_context(self):
+        key = self.__context_reading
+        if key != None:
+            self.__context_reading = None
+            if key != self.__context_key:
+                self.__context_key = None
+                self.__anthy_context.set_string(key[0])
+                if Engine.__segment_mode & SEGMENT_SINGLE:
+                    self.__join_all_segments()
+        # The caller might change the segments of the context.
+        self.__context_key = None
+        return self.__anthy_context
+
+    __context = property(__get_context)
+
     def __ibus_check_version(self, v):
         major = IBus.MAJOR_VERSION
         minor = IBus.MINOR_VERSION
@@ -230,16 +314,18 @@ class Engine(IBus.EngineSimple):
         self.__cursor_pos = 0
         self.__convert_mode = CONV_MODE_OFF
         self.__segments = list()
+        self.__context_reading = None
+        self.__context_candidates = None
         self.__lookup_table.clear()
+        self.__nr_candidates = 0
+        self.__nr_loaded_candidates = 0
         self.__lookup_table_visible = False
         self._MM = 0
         self._SS = 0
         self._H = 0
         self._RMM = 0
         self._RSS = 0
-        if self.__idle_id != 0:
-            GLib.source_remove(self.__idle_id)
-            self.__idle_id = 0
+        self.__cancel_update()
 
     def __init_props(self):
         anthy_props = IBus.PropList()
@@ -250,7 +336,7 @@ class Engine(IBus.EngineSimple):
         self.__set_dict_mode_props(anthy_props)
         self.__set_dict_config_props(anthy_props)
 
-        if not self.__prefs.get_value('common', 'show-preferences'):
+        if not self.__prefs.get_snapshot_value('common', 'show-preferences'):
             return anthy_props
 
         anthy_props.append(IBus.Property(key='setup',
@@ -271,6 +357,7 @@ class Engine(IBus.EngineSimple):
 
     def __signal_cb(self, signum, object):
         self.__remove_dict_files()
+        Engine.STOP_RECORD()
         signal.signal(signum, signal.SIG_DFL)
         os.kill(os.getpid(), signum)
 
@@ -280,10 +367,10 @@ class Engine(IBus.EngineSimple):
             # The config value is readonly for initial engine and
             # the engine keeps the class method in the memory.
             Engine.__input_mode = INPUT_MODE_HIRAGANA
-            Engine.__input_mode = self.__prefs.get_value('common',
+            Engine.__input_mode = self.__prefs.get_snapshot_value('common',
                                                          'input-mode')
 
-        if not self.__prefs.get_value('common', 'show-input-mode'):
+        if not self.__prefs.get_snapshot_value('common', 'show-input-mode'):
             return
 
         # init input mode properties
@@ -373,10 +460,10 @@ class Engine(IBus.EngineSimple):
     def __set_typing_method_props(self, anthy_props):
         if Engine.__typing_mode == None:
             Engine.__typing_mode = jastring.TYPING_MODE_ROMAJI
-            Engine.__typing_mode = self.__prefs.get_value('common',
+            Engine.__typing_mode = self.__prefs.get_snapshot_value('common',
                                                           'typing-method')
 
-        if not self.__prefs.get_value('common', 'show-typing-method'):
+        if not self.__prefs.get_snapshot_value('common', 'show-typing-method'):
             return
 
         # typing input mode properties
@@ -441,10 +528,10 @@ class Engine(IBus.EngineSimple):
     def __set_segment_mode_props(self, anthy_props):
         if Engine.__segment_mode == None:
             Engine.__segment_mode = SEGMENT_DEFAULT
-            Engine.__segment_mode = self.__prefs.get_value('common',
+            Engine.__segment_mode = self.__prefs.get_snapshot_value('common',
                                                            'conversion-segment-mode')
 
-        if not self.__prefs.get_value('common', 'show-segment-mode'):
+        if not self.__prefs.get_snapshot_value('common', 'show-segment-mode'):
             return
 
         symbol = '連'
@@ -519,10 +606,10 @@ class Engine(IBus.EngineSimple):
         if Engine.__dict_mode == None:
             Engine.__dict_mode = 0
 
-        if not self.__prefs.get_value('common', 'show-dict-mode'):
+        if not self.__prefs.get_snapshot_value('common', 'show-dict-mode'):
             return
 
-        dicts = self.__prefs.get_value('dict', 'list')
+        dicts = self.__prefs.get_snapshot_value('dict', 'list')
         short_label = dicts['embedded'].short_label
         label = _("%(description)s (%(symbol)s)") % \
             { 'description' : _("Dictionary mode"), 'symbol' : short_label }
@@ -550,11 +637,11 @@ class Engine(IBus.EngineSimple):
                                    visible=True,
                                    state=IBus.PropState.UNCHECKED,
                                    sub_props=None))
-        order = self.__prefs.get_value('dict', 'order')
+        order = self.__prefs.get_snapshot_value('dict', 'order')
         if len(order) == 0:
-            order = list(self.__prefs.get_value('dict', 'files').keys())
-        files = self.__prefs.get_value('dict', 'files')
-        dicts = self.__prefs.get_value('dict', 'list')
+            order = list(self.__prefs.get_snapshot_value('dict', 'files').keys())
+        files = self.__prefs.get_snapshot_value('dict', 'files')
+        dicts = self.__prefs.get_snapshot_value('dict', 'list')
         for id in order:
             dict_item = dicts[id]
             is_cont = False
@@ -612,11 +699,11 @@ class Engine(IBus.EngineSimple):
                                   IBus.PropState.CHECKED)
 
     def __set_dict_config_props(self, anthy_props):
-        if not self.__prefs.get_value('common', 'show-dict-config'):
+        if not self.__prefs.get_snapshot_value('common', 'show-dict-config'):
             return
 
-        admin_command = self.__prefs.get_value('common', 'dict-admin-command')
-        icon_path = self.__prefs.get_value('common', 'dict-config-icon')
+        admin_command = self.__prefs.get_snapshot_value('common', 'dict-admin-command')
+        icon_path = self.__prefs.get_snapshot_value('common', 'dict-config-icon')
 
         if not path.exists(admin_command[0]):
             return
@@ -677,11 +764,11 @@ class Engine(IBus.EngineSimple):
         return clipboard_text
 
     def __get_single_dict_files(self):
-        order = self.__prefs.get_value('dict', 'order')
+        order = self.__prefs.get_snapshot_value('dict', 'order')
         if len(order) == 0:
-            order = list(self.__prefs.get_value('dict', 'files').keys())
-        files = self.__prefs.get_value('dict', 'files')
-        dicts = self.__prefs.get_value('dict', 'list')
+            order = list(self.__prefs.get_snapshot_value('dict', 'files').keys())
+        files = self.__prefs.get_snapshot_value('dict', 'files')
+        dicts = self.__prefs.get_snapshot_value('dict', 'list')
         single_files = []
         for id in order:
             for file in files[id]:
@@ -693,24 +780,74 @@ class Engine(IBus.EngineSimple):
         return single_files
 
     def __remove_dict_files(self):
-        dicts = self.__prefs.get_value('dict', 'list')
-        files = self.__prefs.get_value('dict', 'files')
+        dicts = self.__prefs.get_snapshot_value('dict', 'list')
+        files = self.__prefs.get_snapshot_value('dict', 'files')
         for id in files.keys():
             dict_item = dicts[id]
             for file in files[id]:
                 self.__remove_dict_file(dict_item, file)
 
-    def update_preedit(self, string, attrs, cursor_pos, visible):
-        text = IBus.Text.new_from_string(string)
+    def __get_attrs_key(self, attrs):
+        key = Engine.__attrs_keys.get(attrs)
+        if key != None:
+            return key
+        key = []
         i = 0
         while attrs.get(i) != None:
             attr = attrs.get(i)
-            text.append_attribute(attr.get_attr_type(),
-                                  attr.get_value(),
-                                  attr.get_start_index(),
-                                  attr.get_end_index())
+            key.append((attr.get_attr_type(),
+                        attr.get_value(),
+                        attr.get_start_index(),
+                        attr.get_end_index()))
             i += 1
-        mode = self.__prefs.get_value('common', 'behavior-on-focus-out')
+        return tuple(key)
+
+    def __new_text(self, string, attrs_key):
+        text = IBus.Text.new_from_string(string)
+        for attr in attrs_key:
+            text.append_attribute(*attr)
+        return text
+
+    # The preedit attributes are reused by the preedit length and
+    # the highlighted range of the converted chars.
+    def __get_attrs(self, length, highlight=None):
+        key = (length, highlight)
+        attrs = Engine.__attrs_cache.get(key)
+        if attrs != None:
+            return attrs
+        if len(Engine.__attrs_cache) >= ATTRS_CACHE_SIZE:
+            Engine.__attrs_cache.clear()
+            Engine.__attrs_keys.clear()
+        attrs = IBus.AttrList()
+        if length > 0:
+            attrs.append(IBus.attr_underline_new(
+                IBus.AttrUnderline.SINGLE, 0, length))
+        if highlight != None:
+            start, end = highlight
+            attrs.append(IBus.attr_background_new(self.__rgb(200, 200, 240),
+                start, end))
+            attrs.append(IBus.attr_foreground_new(self.__rgb(0, 0, 0),
+                start, end))
+        Engine.__attrs_keys[attrs] = self.__get_attrs_key(attrs)
+        Engine.__attrs_cache[key] = attrs
+        return attrs
+
+    # Forget the last sent preedit, aux string and lookup table
+    # when the client or the panel might not show them.
+    def __clear_last_updates(self):
+        self.__last_preedit = None
+        self.__last_aux_string = None
+        self.__last_lookup_table = None
+
+    def update_preedit(self, string, attrs, cursor_pos, visible):
+        attrs_key = self.__get_attrs_key(attrs)
+        mode = self.__prefs.get_snapshot_value('common', 'behavior-on-focus-out')
+        # Do not send the same preedit to ibus-daemon again.
+        last = (string, attrs_key, cursor_pos, visible, mode)
+        if last == self.__last_preedit:
+            return
+        self.__last_preedit = last
+        text = self.__new_text(string, attrs_key)
         if self.__has_update_preedit_text_with_mode and mode == 1:
             self.update_preedit_text_with_mode(text,
                                                cursor_pos, visible,
@@ -720,21 +857,42 @@ class Engine(IBus.EngineSimple):
                                      cursor_pos, visible)
 
     def update_aux_string(self, string, attrs, visible):
-        text = IBus.Text.new_from_string(string)
-        i = 0
-        while attrs.get(i) != None:
-            attr = attrs.get(i)
-            text.append_attribute(attr.get_attr_type(),
-                                  attr.get_value(),
-                                  attr.get_start_index(),
-                                  attr.get_end_index())
-            i += 1
-        self.update_auxiliary_text(text, visible)
+        attrs_key = self.__get_attrs_key(attrs)
+        last = (string, attrs_key, visible)
+        if last == self.__last_aux_string:
+            return
+        self.__last_aux_string = last
+        self.update_auxiliary_text(self.__new_text(string, attrs_key), visible)
+
+    def __update_lookup_table(self):
+        # The hidden lookup table is not compared with the contents
+        # and the shown one is compared with the candidates in the page.
+        last = (False,)
+        if self.__lookup_table_visible:
+            table = self.__lookup_table
+            page_size = table.get_page_size()
+            cursor_pos = table.get_cursor_pos()
+            start = cursor_pos - cursor_pos % page_size
+            end = min(start + page_size, table.get_number_of_candidates())
+            last = (True, cursor_pos, page_size,
+                    table.is_cursor_visible(),
+                    table.get_number_of_candidates(),
+                    tuple([table.get_candidate(i).get_text()
+                           for i in range(start, end)]))
+        if last == self.__last_lookup_table:
+            return
+        self.__last_lookup_table = last
+        self.update_lookup_table(self.__lookup_table,
+                                 self.__lookup_table_visible)
 
     def __page_up(self, obj):
         if self.__convert_mode != CONV_MODE_ANTHY and self.__convert_mode != CONV_MODE_PREDICTION:
             return False
 
+        # page_up() goes round to the last page.
+        if self.__lookup_table.get_cursor_pos() < \
+           self.__lookup_table.get_page_size():
+            self.__load_candidates(self.__nr_candidates)
         if not self.__lookup_table.page_up():
             return False
 
@@ -748,6 +906,10 @@ class Engine(IBus.EngineSimple):
         if self.__convert_mode != CONV_MODE_ANTHY and self.__convert_mode != CONV_MODE_PREDICTION:
             return False
 
+        page_size = self.__lookup_table.get_page_size()
+        self.__load_candidates(self.__lookup_table.get_cursor_pos() -
+                               self.__lookup_table.get_cursor_in_page() +
+                               page_size * 2)
         if not self.__lookup_table.page_down():
             return False
 
@@ -761,6 +923,9 @@ class Engine(IBus.EngineSimple):
         if self.__convert_mode != CONV_MODE_ANTHY and self.__convert_mode != CONV_MODE_PREDICTION:
             return False
 
+        # cursor_up() goes round to the last candidate.
+        if self.__lookup_table.get_cursor_pos() == 0:
+            self.__load_candidates(self.__nr_candidates)
         if not self.__lookup_table.cursor_up():
             return False
 
@@ -776,6 +941,11 @@ class Engine(IBus.EngineSimple):
         if self.__convert_mode != CONV_MODE_ANTHY and self.__convert_mode != CONV_MODE_PREDICTION:
             return False
 
+        # Load the next page which the cursor might move into.
+        page_size = self.__lookup_table.get_page_size()
+        self.__load_candidates(self.__lookup_table.get_cursor_pos() -
+                               self.__lookup_table.get_cursor_in_page() +
+                               page_size * 2)
         if not self.__lookup_table.cursor_down():
             return False
 
@@ -799,13 +969,11 @@ class Engine(IBus.EngineSimple):
 
     def __shrink_segment(self, relative_size):
         self.__context.resize_segment(self.__cursor_pos, relative_size)
-        nr_segments = self.__context.get_nr_segments()
+        segments = self.__context.get_segments(0)
         del self.__segments[self.__cursor_pos:]
-        for i in range(self.__cursor_pos, nr_segments):
-            buf = self.__context.get_segment(i, 0)
-            text = buf
+        for text in segments[self.__cursor_pos:]:
             self.__segments.append((0, text))
-        if not self.__prefs.get_value('common', 'show-lut-on-convert'):
+        if not Engine.__hot_prefs.show_lut_on_convert:
             self.__lookup_table_visible = False
         self.__fill_lookup_table()
         self.__invalidate()
@@ -814,13 +982,11 @@ class Engine(IBus.EngineSimple):
     def __shrink_segment_end(self):
         while self.__context.get_nr_segments() > 1:
             self.__context.resize_segment(self.__cursor_pos, 1)
-            nr_segments = self.__context.get_nr_segments()
+            segments = self.__context.get_segments(0)
             del self.__segments[self.__cursor_pos:]
-            for i in range(self.__cursor_pos, nr_segments):
-                buf = self.__context.get_segment(i, 0)
-                text = buf
+            for text in segments[self.__cursor_pos:]:
                 self.__segments.append((0, text))
-        if not self.__prefs.get_value('common', 'show-lut-on-convert'):
+        if not Engine.__hot_prefs.show_lut_on_convert:
             self.__lookup_table_visible = False
         self.__fill_lookup_table()
         self.__invalidate()
@@ -1026,7 +1192,7 @@ class Engine(IBus.EngineSimple):
         self.__context.do_set_personality(str(dict_name))
 
         prop = self.__prop_dict['DictMode']
-        dicts = self.__prefs.get_value('dict', 'list')
+        dicts = self.__prefs.get_snapshot_value('dict', 'list')
         symbol = dicts[id].short_label
         label = _("%(description)s (%(symbol)s)") % \
             { 'description' : _("Dictionary mode"), 'symbol' : symbol }
@@ -1041,21 +1207,23 @@ class Engine(IBus.EngineSimple):
         return self.__argb(255, r, g, b)
 
     def do_focus_in(self):
+        self.__clear_last_updates()
         self.register_properties(self.__prop_list)
         self.__refresh_typing_mode_property()
-        mode = self.__prefs.get_value('common', 'behavior-on-focus-out')
+        mode = self.__prefs.get_snapshot_value('common', 'behavior-on-focus-out')
         if mode == 2:
             self.__update_input_chars()
 #        self.__reset()
 #        self.__invalidate()
-        size = self.__prefs.get_value('common', 'page-size')
+        size = self.__prefs.get_snapshot_value('common', 'page-size')
         if size != self.__lookup_table.get_page_size():
             self.__lookup_table.set_page_size(size)
 
     def do_focus_out(self):
+        self.__clear_last_updates()
         if self.__has_input_purpose:
             self.__input_purpose = 0
-        mode = self.__prefs.get_value('common', 'behavior-on-focus-out')
+        mode = self.__prefs.get_snapshot_value('common', 'behavior-on-focus-out')
         if mode == 0 or mode == 1:
             self.__reset()
             self.__invalidate()
@@ -1065,20 +1233,22 @@ class Engine(IBus.EngineSimple):
             self.__input_purpose = purpose
 
     def do_disable(self):
+        self.__clear_last_updates()
         self.__reset()
         self.__invalidate()
 
     def do_reset(self):
-        mode = self.__prefs.get_value('common', 'behavior-on-focus-out')
+        mode = self.__prefs.get_snapshot_value('common', 'behavior-on-focus-out')
         if mode == 2:
             return
         self.__reset()
         self.__invalidate()
 
     def __destroy(self, obj):
-        if self.__idle_id != 0:
-            GLib.source_remove(self.__idle_id)
-            self.__idle_id = 0
+        self.__cancel_update()
+        if self.__thumb_timer_id != 0:
+            GLib.source_remove(self.__thumb_timer_id)
+            self.__thumb_timer_id = 0
         # It seems do_destroy() is called when launch_engine() is called.
         #self.__remove_dict_files()
         # It seems super.destroy() does not unref the engine.
@@ -1096,11 +1266,8 @@ class Engine(IBus.EngineSimple):
     def __normalize_preedit(self, preedit):
         if not self.__is_utf8:
             return preedit
-        for key in list(romaji_normalize_rule.keys()):
-            if preedit.find(key) >= 0:
-                for value in romaji_normalize_rule[key]:
-                    preedit = preedit.replace(key, value)
-        return preedit
+        pattern, repl = NORMALIZE_RULE
+        return pattern.sub(repl, preedit)
 
     # begine convert
     def __begin_anthy_convert(self):
@@ -1114,22 +1281,55 @@ class Engine(IBus.EngineSimple):
         text, cursor = self.__preedit_ja_string.get_hiragana(True)
 
         text = self.__normalize_preedit(text)
-        self.__context.set_string(text)
-        if Engine.__segment_mode & SEGMENT_SINGLE:
-            self.__join_all_segments()
-        nr_segments = self.__context.get_nr_segments()
-
-        for i in range(0, nr_segments):
-            buf = self.__context.get_segment(i, 0)
-            text = buf
-            self.__segments.append((0, text))
+        key = (text, Engine.__segment_mode, Engine.__dict_mode)
+        cache = Engine.__convert_cache.get(key)
+        if cache != None:
+            Engine.__convert_cache.move_to_end(key)
+            segments, nr_candidates, candidates = cache
+            # Anthy gets the reading when the context is used next time.
+            self.__context_reading = key
+            nr_segments = len(segments)
+            for text in segments:
+                self.__segments.append((0, text))
+        else:
+            self.__context.set_string(text)
+            if Engine.__segment_mode & SEGMENT_SINGLE:
+                self.__join_all_segments()
+            segments = self.__context.get_segments(0)
+            nr_segments = len(segments)
+            for text in segments:
+                self.__segments.append((0, text))
 
         if Engine.__segment_mode & SEGMENT_IMMEDIATE:
             self.__cursor_pos = nr_segments - 1
         else:
             self.__cursor_pos = 0
+        if cache == None:
+            nr_candidates = self.__context.get_nr_candidates(self.__cursor_pos)
+            candidates = self.__get_candidates(
+                0, min(nr_candidates, self.__lookup_table.get_page_size()))
+            self.__add_convert_cache(key,
+                                     [text for (i, text) in self.__segments],
+                                     nr_candidates, candidates)
+            self.__context_key = key
+        self.__context_candidates = (nr_candidates, candidates)
         self.__fill_lookup_table()
-        self.__lookup_table_visible = self.__prefs.get_value('common', 'show-lut-on-convert')
+        self.__lookup_table_visible = Engine.__hot_prefs.show_lut_on_convert
+
+    def __add_convert_cache(self, key, segments, nr_candidates, candidates):
+        size = self.__prefs.get_snapshot_value('common', 'conversion-cache-size')
+        if size <= 0:
+            return
+        Engine.__convert_cache[key] = (tuple(segments), nr_candidates,
+                                       tuple(candidates))
+        while len(Engine.__convert_cache) > size:
+            Engine.__convert_cache.popitem(last=False)
+
+    @classmethod
+    def __clear_convert_cache(cls):
+        # Anthy learns the committed segments and the next conversion
+        # of the same reading can be different.
+        cls.__convert_cache.clear()
 
     def __end_anthy_convert(self):
         if self.__convert_mode == CONV_MODE_OFF:
@@ -1138,8 +1338,12 @@ class Engine(IBus.EngineSimple):
         self.__convert_mode = CONV_MODE_OFF
         self.__convert_chars = ''
         self.__segments = list()
+        self.__context_reading = None
+        self.__context_candidates = None
         self.__cursor_pos = 0
         self.__lookup_table.clear()
+        self.__nr_candidates = 0
+        self.__nr_loaded_candidates = 0
         self.__lookup_table_visible = False
 
     def __end_convert(self):
@@ -1149,11 +1353,35 @@ class Engine(IBus.EngineSimple):
     def __candidate_cb(self, candidate):
         if not self.__is_utf8:
             return
-        for key in list(romaji_utf8_rule.keys()):
-            if candidate.find(key) >= 0:
-                for value in romaji_utf8_rule[key]:
-                    candidate = candidate.replace(key, value)
-                    self.__lookup_table.append_candidate(IBus.Text.new_from_string(candidate))
+        # Most candidates do not have the keys so the result is cached
+        # by the candidate text including None.
+        variant = Engine.__utf8_candidates.get(candidate, '')
+        if variant == '':
+            pattern, repl = UTF8_RULE
+            variant, n = pattern.subn(repl, candidate)
+            if n == 0:
+                variant = None
+            if len(Engine.__utf8_candidates) >= UTF8_CANDIDATE_CACHE_SIZE:
+                Engine.__utf8_candidates.clear()
+            Engine.__utf8_candidates[candidate] = variant
+        if variant != None:
+            self.__lookup_table.append_candidate(IBus.Text.new_from_string(variant))
+
+    def __get_candidates(self, start, end):
+        return self.__context.get_candidates(self.__cursor_pos,
+                                             start, end - start)
+
+    # The lookup table has the candidates of the shown pages only
+    # and the rest is appended when the cursor moves to them.
+    def __load_candidates(self, nr_candidates):
+        nr_candidates = min(nr_candidates, self.__nr_candidates)
+        if nr_candidates <= self.__nr_loaded_candidates:
+            return
+        for candidate in self.__get_candidates(self.__nr_loaded_candidates,
+                                               nr_candidates):
+            self.__lookup_table.append_candidate(IBus.Text.new_from_string(candidate))
+            self.__candidate_cb(candidate)
+        self.__nr_loaded_candidates = nr_candidates
 
     def __fill_lookup_table(self):
         if self.__convert_mode == CONV_MODE_PREDICTION:
@@ -1161,34 +1389,65 @@ class Engine(IBus.EngineSimple):
 
             # fill lookup_table
             self.__lookup_table.clear()
+            self.__nr_candidates = nr_predictions
+            self.__nr_loaded_candidates = nr_predictions
             if nr_predictions == 0:
                 self.__lookup_table_visible = False
-            for i in range(0, nr_predictions):
-                buf = self.__context.get_prediction(i)
-                candidate = buf
+            for candidate in self.__context.get_predictions():
                 self.__lookup_table.append_candidate(IBus.Text.new_from_string(candidate))
                 self.__candidate_cb(candidate)
             return
 
         # get segment stat
-        nr_candidates = self.__context.get_nr_candidates(self.__cursor_pos)
+        if self.__context_candidates != None:
+            # The first page is prepared by __begin_anthy_convert().
+            nr_candidates, candidates = self.__context_candidates
+            self.__context_candidates = None
+        else:
+            nr_candidates = self.__context.get_nr_candidates(self.__cursor_pos)
+            candidates = self.__get_candidates(
+                0, min(nr_candidates, self.__lookup_table.get_page_size()))
         if nr_candidates == 0:
             self.__lookup_table_visible = False
 
         # fill lookup_table
         self.__lookup_table.clear()
-        for i in range(0, nr_candidates):
-            buf = self.__context.get_segment(self.__cursor_pos, i)
-            candidate = buf
+        self.__nr_candidates = nr_candidates
+        self.__nr_loaded_candidates = 0
+        for candidate in candidates:
             self.__lookup_table.append_candidate(IBus.Text.new_from_string(candidate))
             self.__candidate_cb(candidate)
+        self.__nr_loaded_candidates = len(candidates)
 
 
+    # The preedit is updated in the low priority idle so that the key events
+    # in the queue are collapsed into one update. The update is delayed
+    # until update-interval msecs pass after the last update and is done
+    # by the timeout in update-deadline msecs if the idle is starved.
     def __invalidate(self):
         if self.__idle_id != 0:
+            Engine.__nr_coalesced_updates += 1
             return
-        self.__idle_id = GLib.idle_add(self.__update,
-                                       priority = GLib.PRIORITY_LOW)
+        interval = Engine.__hot_prefs.update_interval
+        deadline = Engine.__hot_prefs.update_deadline
+        delay = self.__last_update_time + interval / 1000.0 - time.monotonic()
+        if delay > 0:
+            self.__idle_id = GLib.timeout_add(int(delay * 1000) + 1,
+                                              self.__update,
+                                              priority = GLib.PRIORITY_LOW)
+        else:
+            self.__idle_id = GLib.idle_add(self.__update,
+                                           priority = GLib.PRIORITY_LOW)
+        if deadline > 0:
+            self.__deadline_id = GLib.timeout_add(deadline, self.__update)
+
+    def __cancel_update(self):
+        if self.__idle_id != 0:
+            GLib.source_remove(self.__idle_id)
+            self.__idle_id = 0
+        if self.__deadline_id != 0:
+            GLib.source_remove(self.__deadline_id)
+            self.__deadline_id = 0
 
 #    def __get_preedit(self):
     def __get_preedit(self, commit=False):
@@ -1207,16 +1466,12 @@ class Engine(IBus.EngineSimple):
 
     def __update_input_chars(self):
         text, cursor = self.__get_preedit()
-        attrs = IBus.AttrList()
-        attrs.append(IBus.attr_underline_new(
-            IBus.AttrUnderline.SINGLE, 0,
-            len(text)))
+        attrs = self.__get_attrs(len(text))
 
         self.update_preedit(text,
             attrs, cursor, not self.__preedit_ja_string.is_empty())
-        self.update_aux_string('', IBus.AttrList(), False)
-        self.update_lookup_table(self.__lookup_table,
-            self.__lookup_table_visible)
+        self.update_aux_string('', self.__get_attrs(0), False)
+        self.__update_lookup_table()
 
     def __update_convert_chars(self):
 #        if self.__convert_mode == CONV_MODE_ANTHY:
@@ -1259,19 +1514,12 @@ class Engine(IBus.EngineSimple):
             text, cursor = self.__preedit_ja_string.get_wide_latin()
             text = text.capitalize()
         self.__convert_chars = text
-        attrs = IBus.AttrList()
-        attrs.append(IBus.attr_underline_new(
-            IBus.AttrUnderline.SINGLE, 0, len(text)))
-        attrs.append(IBus.attr_background_new(self.__rgb(200, 200, 240),
-            0, len(text)))
-        attrs.append(IBus.attr_foreground_new(self.__rgb(0, 0, 0),
-            0, len(text)))
+        attrs = self.__get_attrs(len(text), (0, len(text)))
         self.update_preedit(text, attrs, len(text), True)
 
         self.update_aux_string('',
-            IBus.AttrList(), self.__lookup_table_visible)
-        self.update_lookup_table(self.__lookup_table,
-            self.__lookup_table_visible)
+            self.__get_attrs(0), self.__lookup_table_visible)
+        self.__update_lookup_table()
 
     def __update_anthy_convert_chars(self):
         self.__convert_chars = ''
@@ -1280,26 +1528,26 @@ class Engine(IBus.EngineSimple):
             self.__convert_chars += text
             if i < self.__cursor_pos:
                 pos += len(text)
-        attrs = IBus.AttrList()
-        attrs.append(IBus.attr_underline_new(
-            IBus.AttrUnderline.SINGLE, 0, len(self.__convert_chars)))
-        attrs.append(IBus.attr_background_new(self.__rgb(200, 200, 240),
-                pos, pos + len(self.__segments[self.__cursor_pos][1])))
-        attrs.append(IBus.attr_foreground_new(self.__rgb(0, 0, 0),
-                pos, pos + len(self.__segments[self.__cursor_pos][1])))
+        attrs = self.__get_attrs(len(self.__convert_chars),
+            (pos, pos + len(self.__segments[self.__cursor_pos][1])))
         self.update_preedit(self.__convert_chars, attrs, pos, True)
-        aux_string = '( %d / %d )' % (self.__lookup_table.get_cursor_pos() + 1, self.__lookup_table.get_number_of_candidates())
+        nr_candidates = self.__lookup_table.get_number_of_candidates() + \
+            self.__nr_candidates - self.__nr_loaded_candidates
+        aux_string = '( %d / %d )' % (self.__lookup_table.get_cursor_pos() + 1, nr_candidates)
         self.update_aux_string(aux_string,
-            IBus.AttrList(), self.__lookup_table_visible)
-        self.update_lookup_table(self.__lookup_table,
-            self.__lookup_table_visible)
+            self.__get_attrs(0), self.__lookup_table_visible)
+        self.__update_lookup_table()
 
     def __update(self):
+        # Remove the other source of the idle and the deadline.
+        self.__cancel_update()
         if self.__convert_mode == CONV_MODE_OFF:
             self.__update_input_chars()
         else:
             self.__update_convert_chars()
-        self.__idle_id = 0
+        self.__last_update_time = time.monotonic()
+        Engine.__nr_updates += 1
+        return False
 
     def __on_key_return(self):
         if self.__preedit_ja_string.is_empty():
@@ -1312,9 +1560,11 @@ class Engine(IBus.EngineSimple):
         elif self.__convert_mode == CONV_MODE_ANTHY:
             for i, (seg_index, text) in enumerate(self.__segments):
                 self.__context.commit_segment(i, seg_index)
+            self.__clear_convert_cache()
             self.__commit_string(self.__convert_chars)
         elif self.__convert_mode == CONV_MODE_PREDICTION:
             self.__context.commit_prediction(self.__segments[0][0])
+            self.__clear_convert_cache()
             self.__commit_string(self.__convert_chars)
         else:
             self.__commit_string(self.__convert_chars)
@@ -1381,9 +1631,7 @@ class Engine(IBus.EngineSimple):
                 self.__preedit_ja_string = jastring.JaString(Engine.__typing_mode,
                                                              self.__latin_with_shift)
                 self.__convert_chars = self.__normalize_preedit(all_text)
-                for i in xrange(0, len(self.__convert_chars)):
-                    keyval = self.__convert_chars[i]
-                    self.__preedit_ja_string.insert(chr(ord(keyval)))
+                self.__preedit_ja_string.load_reading(self.__convert_chars)
                 self.__context.set_string(self.__convert_chars)
 
                 # Set self.__segments by anty context
@@ -1569,7 +1817,7 @@ class Engine(IBus.EngineSimple):
             return True
 
         self.__cursor_pos += 1
-        if not self.__prefs.get_value('common', 'show-lut-on-convert'):
+        if not Engine.__hot_prefs.show_lut_on_convert:
             self.__lookup_table_visible = False
         self.__fill_lookup_table()
         self.__invalidate()
@@ -1647,6 +1895,7 @@ class Engine(IBus.EngineSimple):
         elif self.__convert_mode == CONV_MODE_ANTHY:
             for i, (seg_index, text) in enumerate(self.__segments):
                 self.__context.commit_segment(i, seg_index)
+            self.__clear_convert_cache()
             self.__commit_string(self.__convert_chars)
         elif self.__convert_mode != CONV_MODE_OFF:
             self.__commit_string(self.__convert_chars)
@@ -1678,6 +1927,30 @@ class Engine(IBus.EngineSimple):
 
         jastring.JaString.SET_PREFS(cls.__prefs)
 
+    # Save the key events to replay them with 'ibus-engine-anthy --replay'
+    # The file is readable by the user only since it has the typed text.
+    @classmethod
+    def START_RECORD(cls, file):
+        cls.STOP_RECORD()
+        fd = os.open(file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        # The mode of the existing file is not changed by os.open().
+        try:
+            os.fchmod(fd, 0o600)
+        except OSError:
+            os.close(fd)
+            raise
+        cls.__record_file = os.fdopen(fd, 'w')
+
+    @classmethod
+    def STOP_RECORD(cls):
+        if cls.__record_file != None:
+            cls.__record_file.close()
+            cls.__record_file = None
+
+    @classmethod
+    def GET_UPDATE_STATS(cls):
+        return (cls.__nr_updates, cls.__nr_coalesced_updates)
+
     @classmethod
     def CONFIG_VALUE_CHANGED(cls, prefs, section, key, variant):
         if config.DEBUG:
@@ -1685,27 +1958,59 @@ class Engine(IBus.EngineSimple):
         if section == 'shortcut':
             cls.__keybind = cls._mk_keybind()
         elif section == 'common':
-            if key == 'shortcut-type':
+            if key in ('ten-key-mode', 'trigger-periods', 'behavior-on-period',
+                       'show-lut-on-convert', 'behavior-on-select-candidate',
+                       'update-interval', 'update-deadline'):
+                cls._init_hot_prefs()
+            elif key == 'shortcut-type':
                 cls.__keybind = cls._mk_keybind()
             elif key == 'latin-with-shift':
-                value = prefs.get_value(section, key)
+                value = prefs.get_snapshot_value(section, key)
                 cls.__latin_with_shift = value
                 jastring.JaString.RESET(cls.__prefs, section, key, value)
-        elif section == 'kana-typing-rule':
-            value = prefs.get_value(section, key)
+            elif key in ('period-style', 'symbol-style',
+                         'half-width-symbol', 'half-width-number'):
+                value = prefs.get_snapshot_value(section, key)
+                jastring.JaString.RESET(cls.__prefs, section, key, value)
+        elif section == 'romaji-typing-rule' or section == 'kana-typing-rule':
+            value = prefs.get_snapshot_value(section, key)
             jastring.JaString.RESET(cls.__prefs, section, key, value)
+        elif section == 'thumb':
+            # Detect the keyboard layout again when the mode is changed.
+            if key == 'keyboard-layout-mode' and cls.__thumb != None:
+                cls.__thumb.invalidate_xkb_layout()
+                cls.__thumb.reset()
 
     @classmethod
     def _init_prefs(cls):
         prefs = cls.__prefs
-        value = prefs.get_value('common', 'latin-with-shift')
+        value = prefs.get_snapshot_value('common', 'latin-with-shift')
         cls.__latin_with_shift = value
+        cls._init_hot_prefs()
+
+    @classmethod
+    def _init_hot_prefs(cls):
+        prefs = cls.__prefs
+        cls.__hot_prefs = HotPrefs(
+            ten_key_mode=prefs.get_snapshot_value('common', 'ten-key-mode'),
+            trigger_periods=prefs.get_snapshot_value('common',
+                                                     'trigger-periods'),
+            behavior_on_period=prefs.get_snapshot_value('common',
+                                                        'behavior-on-period'),
+            show_lut_on_convert=prefs.get_snapshot_value('common',
+                                                         'show-lut-on-convert'),
+            behavior_on_select_candidate=prefs.get_snapshot_value('common',
+                'behavior-on-select-candidate'),
+            update_interval=prefs.get_snapshot_value('common',
+                                                     'update-interval'),
+            update_deadline=prefs.get_snapshot_value('common',
+                                                     'update-deadline'))
 
     @classmethod
     def _mk_keybind(cls):
         keybind = {}
         sec = cls._get_shortcut_type()
-        shortcuts = cls.__prefs.get_value('shortcut', sec)
+        shortcuts = cls.__prefs.get_snapshot_value('shortcut', sec)
         for k in shortcuts.keys():
             cmd = '_Engine__cmd_' + k
             for s in shortcuts[k]:
@@ -1715,7 +2020,7 @@ class Engine(IBus.EngineSimple):
     @classmethod
     def _get_shortcut_type(cls):
         try:
-            t = cls.__prefs.get_value('common', 'shortcut-type')
+            t = cls.__prefs.get_snapshot_value('common', 'shortcut-type')
         except:
             t = 'default'
         return t
@@ -1738,6 +2043,24 @@ class Engine(IBus.EngineSimple):
         else:
             cls.__thumb.reset()
 
+    # Engine.__keybind has the command names and they are looked up
+    # again only when the shortcut settings are changed.
+    @classmethod
+    def __get_keybind(cls):
+        if Engine.__keybind_functions_base is not Engine.__keybind:
+            keybind = {}
+            for key, cmds in Engine.__keybind.items():
+                functions = []
+                for cmd in cmds:
+                    try:
+                        functions.append(getattr(Engine, cmd))
+                    except AttributeError:
+                        printerr('Unknown command: %s' % cmd)
+                keybind[key] = tuple(functions)
+            Engine.__keybind_functions = keybind
+            Engine.__keybind_functions_base = Engine.__keybind
+        return Engine.__keybind_functions
+
     @staticmethod
     def _mk_key(keyval, state):
         if state & (IBus.ModifierType.CONTROL_MASK | IBus.ModifierType.MOD1_MASK):
@@ -1747,9 +2070,16 @@ class Engine(IBus.EngineSimple):
             elif IBus.KEY_a <= keyval <= IBus.KEY_z:
                 keyval -= (IBus.KEY_a - IBus.KEY_A)
 
-        return repr([int(state), int(keyval)])
+        return (int(state) << 32) | int(keyval)
 
     def __process_key_event(self, obj, keyval, keycode, state):
+        # Do not save the passwords.
+        if Engine.__record_file != None and \
+           not (self.__has_input_purpose and \
+                self.__input_purpose == IBus.InputPurpose.PASSWORD):
+            Engine.__record_file.write('%d %d %d %f\n' %
+                                       (keyval, keycode, state,
+                                        time.monotonic()))
         try:
             return self.__process_key_event_internal2(keyval, keycode, state)
         except:
@@ -1760,21 +2090,33 @@ class Engine(IBus.EngineSimple):
     def __process_key_event_thumb(self, keyval, keycode, state):
         if self.__thumb == None:
             self._reset_thumb()
+        lookup = self.__thumb.get_lookup()
+
+        now = time.monotonic()
 
-        def on_timeout(keyval):
+        def on_timeout():
+            self._H = 0
             if self._MM:
-                insert(self.__thumb.get_char(self._MM)[self._SS])
+                insert(lookup.table[self._MM][self._SS])
             else:
-                cmd_exec([0, RS(), LS()][self._SS])
-            self._H = None
+                cmd_exec(lookup.shift_keys[self._SS])
 
+        # self._H is the monotonic time when the pressed key is decided
+        # as a single keystroke without a chord.
         def start(t):
-            self._H = GLib.timeout_add(t, on_timeout, keyval)
+            self._H = now + t / 1000.0
+            self.__thumb_on_timeout = on_timeout
+            # The armed timer for a later time is replaced.
+            if self.__thumb_timer_id != 0 and \
+               self._H < self.__thumb_timer_deadline:
+                GLib.source_remove(self.__thumb_timer_id)
+                self.__thumb_timer_id = 0
+            if self.__thumb_timer_id == 0:
+                self.__add_thumb_timer(t)
 
         def stop():
             if self._H:
-                GLib.source_remove(self._H)
-                self._H = None
+                self._H = 0
                 return True
             return False
 
@@ -1783,9 +2125,8 @@ class Engine(IBus.EngineSimple):
                 self._MM = self._SS = 0
                 ret = self.__on_key_common(ord(keyval))
                 if (keyval in
-                    self.__prefs.get_value('common', 'trigger-periods')):
-                    behavior = self.__prefs.get_value('common',
-                                                      'behavior-on-period')
+                    Engine.__hot_prefs.trigger_periods):
+                    behavior = Engine.__hot_prefs.behavior_on_period
                     if behavior == 1:
                         return self.__cmd_convert(keyval, state)
                     elif behavior == 2:
@@ -1796,102 +2137,93 @@ class Engine(IBus.EngineSimple):
 
         def cmd_exec(keyval, state=0):
             key = self._mk_key(keyval, state)
-            for cmd in self.__keybind.get(key, []):
+            for cmd in self.__get_keybind().get(key, ()):
                 if config.DEBUG:
-                    print('cmd =', cmd)
+                    print('cmd =', cmd.__name__)
                 try:
-                    if getattr(self, cmd)(keyval, state):
+                    if cmd(self, keyval, state):
                         return True
                 except Exception as err:
-                    printerr('Error command: %s: %s' % (cmd, str(err)))
+                    printerr('Error command: %s: %s' % (cmd.__name__, str(err)))
             return False
 
-        def RS():
-            return self.__thumb.get_rs()
-
-        def LS():
-            return self.__thumb.get_ls()
-
-        def T1():
-            return self.__thumb.get_t1()
-
-        def T2():
-            return self.__thumb.get_t2()
-
         state = state & (IBus.ModifierType.SHIFT_MASK |
                          IBus.ModifierType.CONTROL_MASK |
                          IBus.ModifierType.MOD1_MASK |
                          IBus.ModifierType.RELEASE_MASK)
 
-        if keyval in KP_Table and self.__prefs.get_value('common',
-                                                         'ten-key-mode'):
+        if keyval in KP_Table and Engine.__hot_prefs.ten_key_mode:
             keyval = KP_Table[keyval]
 
+        # The timer might not be dispatched yet after the time is over.
+        if self._H and now >= self._H:
+            self.__thumb_on_timeout()
+
         if state & IBus.ModifierType.RELEASE_MASK:
             if keyval == self._MM:
                 if stop():
-                    insert(self.__thumb.get_char(self._MM)[self._SS])
+                    insert(lookup.table[self._MM][self._SS])
                 self._MM = 0
-            elif (1 if keyval == RS() else 2) == self._SS:
+            elif (1 if keyval == lookup.rs else 2) == self._SS:
                 if stop():
-                    cmd_exec([0, RS(), LS()][self._SS])
+                    cmd_exec(lookup.shift_keys[self._SS])
                 self._SS = 0
-            if keyval in [RS(), LS()]:
+            if keyval in lookup.thumb_keys:
                 self._RSS = 0
             elif keyval == self._RMM:
                 self._RMM = 0
         else:
-            if keyval in [LS(), RS()] and state == 0:
+            if keyval in lookup.thumb_keys and state == 0:
                 if self._SS:
                     stop()
-                    cmd_exec([0, RS(), LS()][self._SS])
-                    self._SS = 1 if keyval == RS() else 2
-                    start(T1())
+                    cmd_exec(lookup.shift_keys[self._SS])
+                    self._SS = 1 if keyval == lookup.rs else 2
+                    start(lookup.t1)
                 elif self._MM:
                     stop()
                     self._RMM = self._MM
-                    self._RSS = 1 if keyval == RS() else 2
-                    insert(self.__thumb.get_char(self._MM)[1 if keyval == RS() else 2])
+                    self._RSS = 1 if keyval == lookup.rs else 2
+                    insert(lookup.table[self._MM][1 if keyval == lookup.rs else 2])
                 else:
-                    if self._RSS == (1 if keyval == RS() else 2):
+                    if self._RSS == (1 if keyval == lookup.rs else 2):
                         if self._RMM:
-                            insert(self.__thumb.get_char(self._RMM)[self._RSS])
+                            insert(lookup.table[self._RMM][self._RSS])
                     else:
-                        self._SS = 1 if keyval == RS() else 2
-                        start(T1())
-            elif keyval in self.__thumb.get_chars() and state == 0:
+                        self._SS = 1 if keyval == lookup.rs else 2
+                        start(lookup.t1)
+            elif keyval in lookup.table and state == 0:
                 if self._MM:
                     stop()
-                    insert(self.__thumb.get_char(self._MM)[self._SS])
-                    start(T2())
+                    insert(lookup.table[self._MM][self._SS])
+                    start(lookup.t2)
                     self._MM = keyval
                 elif self._SS:
                     stop()
                     self._RMM = keyval
                     self._RSS = self._SS
-                    insert(self.__thumb.get_char(keyval)[self._SS])
+                    insert(lookup.table[keyval][self._SS])
                 else:
                     if self._RMM  == keyval:
                         if self._RSS:
-                            insert(self.__thumb.get_char(self._RMM)[self._RSS])
+                            insert(lookup.table[self._RMM][self._RSS])
                     else:
                         if cmd_exec(keyval, state):
                             return True
-                        start(T2())
+                        start(lookup.t2)
                         self._MM = keyval
             else:
                 if self._MM:
                     stop()
-                    insert(self.__thumb.get_char(self._MM)[self._SS])
+                    insert(lookup.table[self._MM][self._SS])
                 elif self._SS:
                     stop()
-                    cmd_exec([0, RS(), LS()][self._SS])
+                    cmd_exec(lookup.shift_keys[self._SS])
                 if cmd_exec(keyval, state):
                     return True
                 elif 0x21 <= keyval <= 0x7e and state & \
                         (IBus.ModifierType.CONTROL_MASK | IBus.ModifierType.MOD1_MASK) == 0:
                     if state & IBus.ModifierType.SHIFT_MASK:
-                        insert(self.__thumb.get_shift_char(keyval, chr(keyval)))
+                        insert(lookup.shift_table.get(keyval, chr(keyval)))
                     elif self._SS == 0:
                         insert(chr(keyval))
                 else:
@@ -1900,6 +2232,23 @@ class Engine(IBus.EngineSimple):
                     return False
         return True
 
+    # One timer is armed for the last pressed key and it waits again
+    # if the key is pressed after the timer was armed.
+    def __add_thumb_timer(self, msec):
+        self.__thumb_timer_deadline = time.monotonic() + msec / 1000.0
+        self.__thumb_timer_id = GLib.timeout_add(msec, self.__on_thumb_timer)
+
+    def __on_thumb_timer(self):
+        self.__thumb_timer_id = 0
+        if self._H == 0:
+            return False
+        delay = self._H - time.monotonic()
+        if delay > 0:
+            self.__add_thumb_timer(int(delay * 1000) + 1)
+            return False
+        self.__thumb_on_timeout()
+        return False
+
     def __process_key_event_internal2(self, keyval, keycode, state):
         if self.__has_input_purpose and \
            self.__input_purpose == IBus.InputPurpose.PASSWORD:
@@ -1919,19 +2268,18 @@ class Engine(IBus.EngineSimple):
         if not is_press:
             return False
 
-        if keyval in KP_Table and self.__prefs.get_value('common',
-                                                         'ten-key-mode'):
+        if keyval in KP_Table and Engine.__hot_prefs.ten_key_mode:
             keyval = KP_Table[keyval]
 
         key = self._mk_key(keyval, state)
-        for cmd in self.__keybind.get(key, []):
+        for cmd in self.__get_keybind().get(key, ()):
             if config.DEBUG:
-                print('cmd =', cmd)
+                print('cmd =', cmd.__name__)
             try:
-                if getattr(self, cmd)(keyval, state):
+                if cmd(self, keyval, state):
                     return True
             except Exception as err:
-                printerr('Error command: %s: %s' % (cmd, str(err)))
+                printerr('Error command: %s: %s' % (cmd.__name__, str(err)))
 
         # If input mode is not LATIN, eat Ctrl+Shift+u
         hex_mod_mask = IBus.ModifierType.SHIFT_MASK | \
@@ -1954,9 +2302,8 @@ class Engine(IBus.EngineSimple):
             ret = self.__on_key_common(keyval, state)
             if (Engine.__input_mode != INPUT_MODE_LATIN and
                 chr(keyval) in
-                self.__prefs.get_value('common', 'trigger-periods')):
-                behavior = self.__prefs.get_value('common',
-                                                  'behavior-on-period')
+                Engine.__hot_prefs.trigger_periods):
+                behavior = Engine.__hot_prefs.behavior_on_period
                 if behavior == 1:
                     return self.__cmd_convert(keyval, state)
                 elif behavior == 2:
@@ -2215,7 +2562,7 @@ class Engine(IBus.EngineSimple):
     def __cmd_insert_space(self, keyval, state):
         if Engine.__input_mode == INPUT_MODE_LATIN:
             return False
-        if (self.__prefs.get_value('common', 'half-width-space') or
+        if (self.__prefs.get_snapshot_value('common', 'half-width-space') or
             Engine.__input_mode == INPUT_MODE_HALF_WIDTH_KATAKANA):
             return self.__cmd_insert_half_space(keyval, state)
         else:
@@ -2224,7 +2571,7 @@ class Engine(IBus.EngineSimple):
     def __cmd_insert_alternate_space(self, keyval, state):
         if Engine.__input_mode == INPUT_MODE_LATIN:
             return False
-        if (self.__prefs.get_value('common', 'half-width-space') or
+        if (self.__prefs.get_snapshot_value('common', 'half-width-space') or
             Engine.__input_mode == INPUT_MODE_HALF_WIDTH_KATAKANA):
             return self.__cmd_insert_wide_space(keyval, state)
         else:
@@ -2301,7 +2648,7 @@ class Engine(IBus.EngineSimple):
         self.__convert_mode = CONV_MODE_PREDICTION
         self.__cursor_pos = 0
         self.__fill_lookup_table()
-        self.__lookup_table_visible = self.__prefs.get_value('common', 'show-lut-on-convert')
+        self.__lookup_table_visible = Engine.__hot_prefs.show_lut_on_convert
         self.__invalidate()
 
         return True
@@ -2351,22 +2698,16 @@ class Engine(IBus.EngineSimple):
             return False
 
         self.__convert_chars = clipboard_text
-        for i in range(0, len(self.__convert_chars)):
-            keyval = self.__convert_chars[i]
-            self.__preedit_ja_string.insert(chr(ord(keyval)))
+        self.__preedit_ja_string.load_reading(self.__convert_chars)
 
         self.__context.set_string(self.__convert_chars)
-        nr_segments = self.__context.get_nr_segments()
-
-        for i in range(0, nr_segments):
-            buf = self.__context.get_segment(i, 0)
-            text = buf
+        for text in self.__context.get_segments(0):
             self.__segments.append((0, text))
 
         self.__convert_mode = CONV_MODE_ANTHY
         self.__cursor_pos = 0
         self.__fill_lookup_table()
-        self.__lookup_table_visible = self.__prefs.get_value('common', 'show-lut-on-convert')
+        self.__lookup_table_visible = Engine.__hot_prefs.show_lut_on_convert
         self.__invalidate()
 
         return True
@@ -2412,7 +2753,7 @@ class Engine(IBus.EngineSimple):
 
         if 0 <= pos < len(self.__segments) and pos != self.__cursor_pos:
             self.__cursor_pos = pos
-            if not self.__prefs.get_value('common', 'show-lut-on-convert'):
+            if not Engine.__hot_prefs.show_lut_on_convert:
                 self.__lookup_table_visible = False
             self.__fill_lookup_table()
             self.__invalidate()
@@ -2469,12 +2810,12 @@ class Engine(IBus.EngineSimple):
 
             text, cursor = self.__get_preedit()
             commit_length = 0
-            for i in range(0, commit_index + 1):
-                buf = self.__context.get_segment(i, NTH_UNCONVERTED_CANDIDATE)
+            segments = self.__context.get_segments(NTH_UNCONVERTED_CANDIDATE)
+            for buf in segments[:commit_index + 1]:
                 commit_length += len(buf)
             self.__move_cursor_char_length(commit_length - cursor)
-            for i in range(0, commit_length):
-                self.__preedit_ja_string.remove_before()
+            self.__preedit_ja_string.remove_range(
+                0, self.__preedit_ja_string.get_cursor())
             self.__move_cursor_char_length(cursor - commit_length)
 
             del self.__segments[0:commit_index + 1]
@@ -2491,10 +2832,12 @@ class Engine(IBus.EngineSimple):
             self.__context.set_string(text)
 
         self.__lookup_table.clear()
+        self.__nr_candidates = 0
+        self.__nr_loaded_candidates = 0
         self.__lookup_table.set_cursor_visible(False)
-        if not self.__prefs.get_value('common', 'show-lut-on-convert'):
+        if not Engine.__hot_prefs.show_lut_on_convert:
             self.__lookup_table_visible = False
-        self.update_aux_string('', IBus.AttrList(),
+        self.update_aux_string('', self.__get_attrs(0),
             self.__lookup_table_visible)
         self.__fill_lookup_table()
         self.__invalidate()
@@ -2518,13 +2861,14 @@ class Engine(IBus.EngineSimple):
         cursor_pos = self.__lookup_table.get_cursor_pos()
         cursor_in_page = self.__lookup_table.get_cursor_in_page()
         real_index = cursor_pos - cursor_in_page + index
+        self.__load_candidates(real_index + 1)
         if real_index >= self.__lookup_table.get_number_of_candidates():
             return False
         self.__lookup_table.set_cursor_pos(real_index)
         index = self.__lookup_table.get_cursor_pos()
         candidate = self.__lookup_table.get_candidate(index).get_text()
         self.__segments[self.__cursor_pos] = index, candidate
-        mode = self.__prefs.get_value('common', 'behavior-on-select-candidate')
+        mode = Engine.__hot_prefs.behavior_on_select_candidate
         if mode == 0:
             self.__on_key_right()
         elif mode == 1:
@@ -2532,6 +2876,7 @@ class Engine(IBus.EngineSimple):
                 self.__commit_nth_segment(self.__cursor_pos, 0, 0)
             elif self.__convert_mode == CONV_MODE_PREDICTION:
                 self.__context.commit_prediction(self.__segments[0][0])
+                self.__clear_convert_cache()
                 self.__commit_string(self.__segments[0][1])
         self.__invalidate()
         return True
@@ -2831,11 +3176,11 @@ class Engine(IBus.EngineSimple):
         return True
 
     def __start_dict_admin(self):
-        command = self.__prefs.get_value('common', 'dict-admin-command')
+        command = self.__prefs.get_snapshot_value('common', 'dict-admin-command')
         os.spawnl(os.P_NOWAIT, *command)
 
     def __start_add_word(self):
-        command = self.__prefs.get_value('common', 'add-word-command')
+        command = self.__prefs.get_snapshot_value('common', 'add-word-command')
         os.spawnl(os.P_NOWAIT, *command)
 
     def __start_setup(self):
@@ -21,11 +21,14 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+
 import romaji
 import kana
 import thumb
 
-from segment import unichar_half_to_full
+from segment import ReadingSegment, unichar_half_to_full
 
 HalfSymbolTable = {}
 for i in range(32, 127):
@@ -53,19 +56,27 @@ class JaString:
     _mode = TYPING_MODE_ROMAJI
     _shift = False
     _unshift = False
+    _chk_tables = {}
 
     def __init__(self, mode=TYPING_MODE_ROMAJI, latin_with_shift=True):
         self._init_mode(mode)
         if mode == TYPING_MODE_ROMAJI:
             romaji.RomajiSegment.SET_LATIN_WITH_SHIFT(latin_with_shift)
+        # Each engine has the own segments.
+        self.__cursor = 0
+        self.__segments = list()
+        # The converted strings of each segment by the segment method name
+        # and the joined strings before and after the cursor.
+        self.__outputs = {}
+        self.__joined = {}
+        # The prefix sums of the output lengths by the segment method name
+        self.__offsets = {}
 
     @classmethod
     def _init_mode(cls, mode):
         cls._mode = mode
         cls._shift = False
         cls._unshift = False
-        cls.__cursor = 0
-        cls.__segments = list()
         if mode == TYPING_MODE_ROMAJI:
             romaji.RomajiSegment.INIT_ROMAJI_TYPING_RULE(cls._prefs)
         elif mode == TYPING_MODE_KANA:
@@ -84,8 +95,14 @@ class JaString:
             mode = TYPING_MODE_KANA
             kana.KanaSegment.RESET(prefs, section, key, value)
             cls._init_mode(mode)
+        if section == 'romaji-typing-rule':
+            romaji.RomajiSegment.RESET(prefs, section, key, value)
         if section == 'common' and key == 'latin-with-shift':
             romaji.RomajiSegment.SET_LATIN_WITH_SHIFT(value)
+        if section == 'common' and key in ('period-style', 'symbol-style',
+                                           'half-width-symbol',
+                                           'half-width-number'):
+            cls._chk_tables = {}
 
     def set_shift(self, shift):
         self._shift = shift
@@ -98,12 +115,16 @@ class JaString:
         segment_before = None
         segment_after = None
         new_segments = None
+        # The segments[start:end] are updated.
+        start = self.__cursor
+        end = self.__cursor
 
         if self.__cursor >= 1:
             segment_before = self.__segments[self.__cursor - 1]
         if self.__cursor < len(self.__segments):
             segment_after = self.__segments[self.__cursor]
         if segment_before and not segment_before.is_finished():
+            start -= 1
             if type(segment_before) == romaji.RomajiSegment:
                 new_segments = segment_before.append(c,
                                                      self._shift,
@@ -112,6 +133,7 @@ class JaString:
             else:
                 new_segments = segment_before.append(c)
         elif segment_after and not segment_after.is_finished():
+            end += 1
             if type(segment_after) == romaji.RomajiSegment:
                 new_segments = segment_after.prepend(c,
                                                      self._shift,
@@ -135,6 +157,19 @@ class JaString:
         if new_segments:
             self.__segments[self.__cursor:self.__cursor] = new_segments
             self.__cursor += len(new_segments)
+        else:
+            new_segments = []
+        self.__update_outputs(start, end, end - start + len(new_segments))
+
+    # The reading is already converted by anthy or the clipboard
+    # so each char is loaded as a finished segment without the typing rules.
+    # The kana segments of e.g. 'か' are not finished for the voiced mark.
+    def load_reading(self, text):
+        new_segments = [ReadingSegment(c, c) for c in text]
+        start = self.__cursor
+        self.__segments[start:start] = new_segments
+        self.__cursor += len(new_segments)
+        self.__update_outputs(start, start, len(new_segments))
 
     def remove_before(self):
         index = self.__cursor - 1
@@ -144,6 +179,9 @@ class JaString:
             if segment.is_empty():
                 del self.__segments[index]
                 self.__cursor = index
+                self.__update_outputs(index, index + 1, 0)
+            else:
+                self.__update_outputs(index, index + 1, 1)
             return True
 
         return False
@@ -155,142 +193,170 @@ class JaString:
             segment.pop()
             if segment.is_empty():
                 del self.__segments[index]
+                self.__update_outputs(index, index + 1, 0)
+            else:
+                self.__update_outputs(index, index + 1, 1)
             return True
 
         return False
 
+    # Remove the segments[start:end] at once.
+    def remove_range(self, start, end):
+        start = max(start, 0)
+        end = min(end, len(self.__segments))
+        if start >= end:
+            return False
+        del self.__segments[start:end]
+        if self.__cursor >= end:
+            self.__cursor -= end - start
+        elif self.__cursor > start:
+            self.__cursor = start
+        self.__update_outputs(start, end, 0)
+        return True
+
     def get_string(self, type):
         pass
 
+    def __update_outputs(self, start, end, length):
+        # The old segments[start:end] were replaced by
+        # the new segments[start:start + length].
+        segments = self.__segments[start:start + length]
+        for method, outputs in self.__outputs.items():
+            outputs[start:end] = [getattr(s, method)() for s in segments]
+        self.__joined = {}
+        self.__offsets = {}
+
+    def __get_outputs(self, method):
+        outputs = self.__outputs.get(method)
+        if outputs == None:
+            outputs = [getattr(s, method)() for s in self.__segments]
+            self.__outputs[method] = outputs
+        return outputs
+
+    def __get_offsets(self, method):
+        offsets = self.__offsets.get(method)
+        if offsets == None:
+            offsets = [0]
+            offsets.extend(accumulate(map(len, self.__get_outputs(method))))
+            self.__offsets[method] = offsets
+        return offsets
+
+    def __join(self, method):
+        joined = self.__joined.get(method)
+        if joined != None:
+            return joined
+        outputs = self.__get_outputs(method)
+        joined = (''.join(outputs[:self.__cursor]),
+                  ''.join(outputs[self.__cursor:]))
+        self.__joined[method] = joined
+        return joined
+
     def move_cursor(self, delta):
         self.__cursor += delta
         if self.__cursor < 0:
             self.__cursor = 0
         elif self.__cursor > len(self.__segments):
             self.__cursor = len(self.__segments)
+        self.__joined = {}
+
+    def get_cursor(self):
+        return self.__cursor
 
     # hiragana segments are not char lengths.
     # e.g. 'ya' is 1 segment and 1 char and 'kya' is 1 segment and 2 chars.
-    def move_cursor_hiragana_length(self, length):
-        delta = length
-        if delta < 0:
-            if self.__cursor >= len(self.__segments):
-                delta = delta + (self.__cursor - len(self.__segments) + 1)
-                self.__cursor = len(self.__segments) - 1
-            while delta < 0:
-                text = str(self.__segments[self.__cursor].to_hiragana())
-                if len(text) > -delta:
-                    break
-                delta = delta + len(text)
-                self.__cursor = self.__cursor - 1
+    # The cursor stops at the segment boundary which does not go over
+    # the length.
+    def __move_cursor_length(self, method, length):
+        self.__joined = {}
+        offsets = self.__get_offsets(method)
+        offset = offsets[self.__cursor] + length
+        if length < 0:
+            self.__cursor = bisect_left(offsets, max(offset, 0))
         else:
-            if self.__cursor >= len(self.__segments):
-                self.__cursor = len(self.__segments)
-                return
-            while delta > 0:
-                text = str(self.__segments[self.__cursor].to_hiragana())
-                if len(text) > delta:
-                    break
-                delta = delta - len(text)
-                self.__cursor = self.__cursor + 1
+            self.__cursor = bisect_right(offsets, offset) - 1
+
+    def move_cursor_hiragana_length(self, length):
+        self.__move_cursor_length('to_hiragana', length)
 
     def move_cursor_katakana_length(self, length):
-        delta = length
-        if delta < 0:
-            if self.__cursor >= len(self.__segments):
-                delta = delta + (self.__cursor - len(self.__segments) + 1)
-                self.__cursor = len(self.__segments) - 1
-            while delta < 0:
-                text = str(self.__segments[self.__cursor].to_katanaka())
-                if len(text) > -delta:
-                    break
-                delta = delta + len(text)
-                self.__cursor = self.__cursor - 1
-        else:
-            if self.__cursor >= len(self.__segments):
-                self.__cursor = len(self.__segments)
-                return
-            while delta > 0:
-                text = str(self.__segments[self.__cursor].to_katanaka())
-                if len(text) > delta:
-                    break
-                delta = delta - len(text)
-                self.__cursor = self.__cursor + 1
+        self.__move_cursor_length('to_katakana', length)
 
     def move_cursor_half_with_katakana_length(self, length):
-        delta = length
-        if delta < 0:
-            if self.__cursor >= len(self.__segments):
-                delta = delta + (self.__cursor - len(self.__segments) + 1)
-                self.__cursor = len(self.__segments) - 1
-            while delta < 0:
-                text = str(self.__segments[self.__cursor].to_half_width_katakana())
-                if len(text) > -delta:
-                    break
-                delta = delta + len(text)
-                self.__cursor = self.__cursor - 1
-        else:
-            if self.__cursor >= len(self.__segments):
-                self.__cursor = len(self.__segments)
-                return
-            while delta > 0:
-                text = str(self.__segments[self.__cursor].to_half_width_katakana())
-                if len(text) > delta:
-                    break
-                delta = delta - len(text)
-                self.__cursor = self.__cursor + 1
+        self.__move_cursor_length('to_half_width_katakana', length)
+
+    @classmethod
+    def __get_chk_table(cls):
+        period = cls._prefs.get_snapshot_value('common', 'period-style')
+        symbol = cls._prefs.get_snapshot_value('common', 'symbol-style')
+        half_symbol = cls._prefs.get_snapshot_value('common', 'half-width-symbol')
+        half_number = cls._prefs.get_snapshot_value('common', 'half-width-number')
+        # thumb_left + '2' and '/' are different
+        if cls._mode == TYPING_MODE_THUMB_SHIFT:
+            symbol = 0
+        key = (period, symbol, half_symbol, half_number, cls._mode)
+        if key in cls._chk_tables:
+            return cls._chk_tables[key]
+        tables = []
+        if period:
+            tables.append(PeriodTable)
+        if symbol:
+            tables.append(SymbolTable[symbol])
+        if half_symbol:
+            tables.append(HalfSymbolTable)
+        if half_number:
+            tables.append(HalfNumberTable)
+        # Compose the tables into one so that a character is converted
+        # in the same order as the tables are applied one by one.
+        chk_table = {}
+        for table in tables:
+            for c in table:
+                if ord(c) in chk_table:
+                    continue
+                t = c
+                for _table in tables:
+                    t = _table.get(t, t)
+                if t != c:
+                    chk_table[ord(c)] = t
+        cls._chk_tables[key] = chk_table
+        return chk_table
 
     def _chk_text(self, s):
-        period = self._prefs.get_value('common', 'period-style')
-        symbol = self._prefs.get_value('common', 'symbol-style')
-        half_symbol = self._prefs.get_value('common', 'half-width-symbol')
-        half_number = self._prefs.get_value('common', 'half-width-number')
-        ret = ''
-        for c in s:
-            c = c if not period else PeriodTable.get(c, c)
-            # thumb_left + '2' and '/' are different
-            if self._mode != TYPING_MODE_THUMB_SHIFT:
-                c = c if not symbol else SymbolTable[symbol].get(c, c)
-            c = c if not half_symbol else HalfSymbolTable.get(c, c)
-            c = c if not half_number else HalfNumberTable.get(c, c)
-            ret += c
-        return ret
+        return s.translate(self.__get_chk_table())
 
     def get_hiragana(self, commit=False):
-        conv = lambda s: s.to_hiragana()
         R = lambda s: s if not (commit and s[-1:] == 'n') else s[:-1] + 'ん'
-        text_before = R(''.join(map(conv, self.__segments[:self.__cursor])))
-        text_after = R(''.join(map(conv, self.__segments[self.__cursor:])))
+        text_before, text_after = self.__join('to_hiragana')
+        text_before = R(text_before)
+        text_after = R(text_after)
         return self._chk_text(text_before + text_after), len(text_before)
 
     def get_katakana(self, commit=False):
-        conv = lambda s: s.to_katakana()
         R = lambda s: s if not (commit and s[-1:] == 'n') else s[:-1] + 'ン'
-        text_before = R(''.join(map(conv, self.__segments[:self.__cursor])))
-        text_after = R(''.join(map(conv, self.__segments[self.__cursor:])))
+        text_before, text_after = self.__join('to_katakana')
+        text_before = R(text_before)
+        text_after = R(text_after)
         return self._chk_text(text_before + text_after), len(text_before)
 
     def get_half_width_katakana(self, commit=False):
-        conv = lambda s: s.to_half_width_katakana()
         R = lambda s: s if not (commit and s[-1:] == 'n') else s[:-1] + 'ﾝ'
-        text_before = R(''.join(map(conv, self.__segments[:self.__cursor])))
-        text_after = R(''.join(map(conv, self.__segments[self.__cursor:])))
+        text_before, text_after = self.__join('to_half_width_katakana')
+        text_before = R(text_before)
+        text_after = R(text_after)
         return self._chk_text(text_before + text_after), len(text_before)
 
     def get_latin(self):
-        conv = lambda s: s.to_latin()
-        text_before = ''.join(map(conv, self.__segments[:self.__cursor]))
-        text_after = ''.join(map(conv, self.__segments[self.__cursor:]))
+        text_before, text_after = self.__join('to_latin')
         return text_before + text_after, len(text_before)
 
     def get_wide_latin(self):
-        conv = lambda s: s.to_wide_latin()
-        text_before = ''.join(map(conv, self.__segments[:self.__cursor]))
-        text_after = ''.join(map(conv, self.__segments[self.__cursor:]))
+        text_before, text_after = self.__join('to_wide_latin')
         return text_before + text_after, len(text_before)
 
     def is_empty(self):
-        return all([s.is_empty() for s in self.__segments])
+        # A segment is empty when both enchars and jachars are empty
+        # so it's same with the empty hiragana.
+        text_before, text_after = self.__join('to_hiragana')
+        return text_before == '' and text_after == ''
 
     def get_raw(self, start, end):
         i = 0
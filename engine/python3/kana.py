@@ -25,99 +25,106 @@ import sys
 
 from tables import *
 import segment
+import typingcache
 
 _UNFINISHED_HIRAGANA = set('かきくけこさしすせそたちつてとはひふへほ')
 
 class KanaSegment(segment.Segment):
+    __slots__ = ()
     _prefs = None
     _kana_typing_rule_method = None
+    # The typed chars to kana of the current method
+    _kana_rule = None
+    # (kana, typed char) to the voiced or semi-voiced kana
     _kana_voiced_consonant_rule = None
-    _kana_voiced_consonant_dict = None
 
     def __init__(self, enchars='', jachars=''):
         if not jachars:
-            jachars = self.__get_kana_typing_rule(enchars, '')
+            jachars = self._kana_rule.get(enchars, '')
         super(KanaSegment, self).__init__(enchars, jachars)
 
     @classmethod
     def INIT_KANA_TYPING_RULE(cls, prefs):
-        cls._prefs = prefs
-        if prefs == None:
-            cls._kana_typing_rule_method = None
+        # JaString calls this method whenever the preedit is reset
+        # so compile the tables only when prefs are changed.
+        if cls._kana_rule != None and cls._prefs == prefs:
             return
-        if cls._kana_typing_rule_method == None:
+        cls._prefs = prefs
+        cls._kana_typing_rule_method = None
+        if prefs != None:
             cls._init_kana_typing_method()
-        if cls._kana_voiced_consonant_rule == None and \
-           cls._kana_typing_rule_method != None:
-            cls._init_kana_voiced_consonant_rule()
+        method = cls._kana_typing_rule_method
+        cache_key = None
+        if method != None:
+            keymap = prefs.get_snapshot_value('kana-typing-rule', 'list')
+            cache_key = typingcache.get_key(method,
+                                            sorted(keymap[method].items()))
+            tables = typingcache.load('kana', cache_key)
+            if tables != None:
+                cls._kana_rule, cls._kana_voiced_consonant_rule = tables
+                return
+        cls._init_kana_rule()
+        cls._init_kana_voiced_consonant_rule()
+        if cache_key != None:
+            typingcache.save('kana', cache_key,
+                             (cls._kana_rule, cls._kana_voiced_consonant_rule))
 
     @classmethod
     def _init_kana_typing_method(cls, method=None):
         prefs = cls._prefs
         if method == None:
-            method = prefs.get_value('kana-typing-rule', 'method')
+            method = prefs.get_snapshot_value('kana-typing-rule', 'method')
         if method == None:
             method = 'jp'
         cls._kana_typing_rule_method = method
-        keymap = prefs.get_value('kana-typing-rule', 'list')
+        keymap = prefs.get_snapshot_value('kana-typing-rule', 'list')
         if cls._kana_typing_rule_method not in keymap.keys():
             cls._kana_typing_rule_method = None
 
     @classmethod
-    def _init_kana_voiced_consonant_rule(cls):
+    def _init_kana_rule(cls):
+        method = cls._kana_typing_rule_method
+        if method == None:
+            cls._kana_rule = kana_typing_rule_static
+            return
         prefs = cls._prefs
+        # Convert the gsettings keys to the typed chars here
+        # instead of converting the typed chars on each key event.
+        cls._kana_rule = {}
+        keymap = prefs.get_snapshot_value('kana-typing-rule', 'list')[method]
+        for gkey, value in keymap.items():
+            if value == None or value == '':
+                continue
+            key = prefs.typing_from_config_key(gkey)
+            if key == '':
+                continue
+            cls._kana_rule[key] = value
+
+    @classmethod
+    def _init_kana_voiced_consonant_rule(cls):
         # Create kana_voiced_consonant_rule dynamically.
         # E.g. 't' + '@' on jp kbd becomes Hiragana GA
         # 't' + '[' on us kbd becomes Hiragana GA
         # If the customized table provides U+309b with other chars,
         # it needs to be detected dynamically.
         cls._kana_voiced_consonant_rule = {}
-        method = cls._kana_typing_rule_method
-        keymap = prefs.get_value('kana-typing-rule', 'list')[method]
-        for gkey in keymap.keys():
-            value = keymap[gkey]
-            key = prefs.typing_from_config_key(gkey)
-            if key == '':
-                continue
+        for key, value in cls._kana_rule.items():
             if value == chr(0x309b):
-                for no_voiced, voiced in \
-                        list(kana_voiced_consonant_no_rule.items()):
-                    rule = no_voiced + key
-                    cls._kana_voiced_consonant_rule[rule] = voiced
-            if value == chr(0x309c):
-                for no_voiced, voiced in \
-                        list(kana_semi_voiced_consonant_no_rule.items()):
-                    rule = no_voiced + key
-                    cls._kana_voiced_consonant_rule[rule] = voiced
+                rule = kana_voiced_consonant_no_rule
+            elif value == chr(0x309c):
+                rule = kana_semi_voiced_consonant_no_rule
+            else:
+                continue
+            for no_voiced, voiced in rule.items():
+                cls._kana_voiced_consonant_rule[(no_voiced, key)] = voiced
 
     @classmethod
     def RESET(cls, prefs, section, key, value):
-        cls._prefs = prefs
         if section == 'kana-typing-rule' and value != None:
-            cls._kana_typing_rule_method = None
-            cls._kana_voiced_consonant_rule = None
+            cls._kana_rule = None
             cls.INIT_KANA_TYPING_RULE(prefs)
-
-    def __get_kana_typing_rule(self, enchars, retval=None):
-        prefs = self._prefs
-        value = None
-        method = self._kana_typing_rule_method
-        if method != None:
-            # Need to send Unicode to typing_to_config_key instead of UTF-8
-            # not to separate U+A5
-            gkey = prefs.typing_to_config_key(enchars)
-            if gkey == '':
-                return None
-            enchars = gkey
-            keymap = prefs.get_value('kana-typing-rule', 'list')[method]
-            value = keymap.get(enchars)
-            if value == '':
-                value = None
-            if value == None:
-                value = retval 
         else:
-            value = kana_typing_rule_static.get(enchars, retval)
-        return value
+            cls._prefs = prefs
 
     def is_finished(self):
         return not (self._jachars in _UNFINISHED_HIRAGANA)
@@ -126,16 +133,15 @@ class KanaSegment(segment.Segment):
         if enchar == '\0' or enchar == '':
             return []
         if self._jachars:
-            text = self._jachars + enchar
-            if self._kana_voiced_consonant_rule != None:
-                jachars = self._kana_voiced_consonant_rule.get(text, None)
+            jachars = self._kana_voiced_consonant_rule.get(
+                (self._jachars, enchar))
             if jachars:
                 self._enchars = self._enchars + enchar
                 self._jachars = jachars
                 return []
             return [KanaSegment(enchar)]
         self._enchars = self._enchars + enchar
-        self._jachars = self.__get_kana_typing_rule(self._enchars, '')
+        self._jachars = self._kana_rule.get(self._enchars, '')
         return []
 
     def prepend(self, enchar):
@@ -143,7 +149,7 @@ class KanaSegment(segment.Segment):
             return []
         if self._enchars == '':
             self._enchars = enchar
-            self._jachars = self.__get_kana_typing_rule(self._enchars, '')
+            self._jachars = self._kana_rule.get(self._enchars, '')
             return []
         return [KanaSegment(enchar)]
 
@@ -159,4 +165,4 @@ class KanaSegment(segment.Segment):
             enchars = list(self._enchars)
             del enchars[index]
             self._enchars = ''.join(enchars)
-            self._jachars = self.__get_kana_typing_rule(self._enchars, '')
+            self._jachars = self._kana_rule.get(self._enchars, '')
@@ -26,6 +26,7 @@ from os import path
 import sys
 import getopt
 import locale
+import time
 import xml.dom.minidom
 
 from gi import require_version as gi_require_version
@@ -81,8 +82,78 @@ class IMApp:
         self.__mainloop.quit()
 
 
-def launch_engine(exec_by_ibus):
-    IMApp(exec_by_ibus).run()
+def launch_engine(exec_by_ibus, record_file=None):
+    if record_file == None:
+        IMApp(exec_by_ibus).run()
+        return
+    import engine
+    engine.Engine.START_RECORD(record_file)
+    try:
+        IMApp(exec_by_ibus).run()
+    finally:
+        engine.Engine.STOP_RECORD()
+
+
+class ReplayBus:
+    # The replayed engine does not connect to ibus-daemon.
+    def get_connection(self):
+        return None
+
+
+def replay_engine(record_file, profile):
+    events = []
+    with open(record_file, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line == '' or line.startswith('#'):
+                continue
+            keyval, keycode, state, timestamp = line.split()
+            events.append((int(keyval), int(keycode), int(state),
+                           float(timestamp)))
+    if len(events) == 0:
+        return
+
+    import engine
+    engine.Engine.CONFIG_RELOADED()
+    anthy_engine = engine.Engine(ReplayBus(),
+                                 factory.EngineFactory.ENGINE_PATH + '/0')
+    context = GLib.MainContext.default()
+    profiler = None
+    if profile:
+        import cProfile
+        profiler = cProfile.Profile()
+
+    def dispatch(func, *args):
+        if profiler != None:
+            profiler.enable()
+        func(*args)
+        while context.pending():
+            context.iteration(False)
+        if profiler != None:
+            profiler.disable()
+
+    # Keep the intervals of the key events for the timeouts in
+    # the thumb shift typing.
+    start = time.monotonic() - events[0][3]
+    for keyval, keycode, state, timestamp in events:
+        while True:
+            delay = start + timestamp - time.monotonic()
+            if delay <= 0:
+                break
+            time.sleep(min(delay, 0.001))
+            dispatch(lambda: None)
+        dispatch(anthy_engine.emit, 'process-key-event',
+                 keyval, keycode, state)
+    anthy_engine.destroy()
+
+    nr_updates, nr_coalesced_updates = engine.Engine.GET_UPDATE_STATS()
+    print('%d key events, %d preedit updates, %d coalesced updates' % \
+          (len(events), nr_updates, nr_coalesced_updates))
+
+    if profiler != None:
+        import pstats
+        stats = pstats.Stats(profiler, stream=sys.stdout)
+        stats.sort_stats('cumulative').print_stats(40)
 
 def get_userhome():
     if 'HOME' not in os.environ:
@@ -144,6 +215,11 @@ def print_help(out, v = 0):
     print('-h, --help             show this message.', file=out)
     print('-d, --daemonize        daemonize ibus.', file=out)
     print('-x, --xml              print engine xml.', file=out)
+    print('-r, --record=FILE      save key events to FILE.', file=out)
+    print('-R, --replay=FILE      replay key events in FILE without ibus.',
+          file=out)
+    print('-p, --profile          profile the replayed key events.',
+          file=out)
     sys.exit(v)
 
 def main():
@@ -155,9 +231,13 @@ def main():
     exec_by_ibus = False
     daemonize = False
     xml = False
+    record_file = None
+    replay_file = None
+    profile = False
 
-    shortopt = 'ihdx'
-    longopt = ['ibus', 'help', 'daemonize', 'xml']
+    shortopt = 'ihdxr:R:p'
+    longopt = ['ibus', 'help', 'daemonize', 'xml',
+               'record=', 'replay=', 'profile']
 
     try:
         opts, args = getopt.getopt(sys.argv[1:], shortopt, longopt)
@@ -173,6 +253,12 @@ def main():
             exec_by_ibus = True
         elif o in ('-x', '--xml'):
             xml = True
+        elif o in ('-r', '--record'):
+            record_file = a
+        elif o in ('-R', '--replay'):
+            replay_file = a
+        elif o in ('-p', '--profile'):
+            profile = True
         else:
             print('Unknown argument: %s' % o, file=sys.stderr)
             print_help(sys.stderr, 1)
@@ -186,7 +272,11 @@ def main():
         print_xml()
         return
 
-    launch_engine(exec_by_ibus)
+    if replay_file != None:
+        replay_engine(replay_file, profile)
+        return
+
+    launch_engine(exec_by_ibus, record_file)
 
 if __name__ == '__main__':
     main()
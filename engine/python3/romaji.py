@@ -25,17 +25,84 @@ import sys
 
 from tables import *
 import segment
+import typingcache
 
 def romaji_correction_rule_get(k, d):
     return ('ん', k[1:2]) if k[0:1] == 'n' and not k[1:2] in "aiueony'" else d
 
+# The chars which can be typed in the romaji mode. romaji_correction_rule_get()
+# matches 'n' + any other char so it's expanded with the chars.
+_CORRECTION_CHARS = ''.join([chr(i) for i in range(0x20, 0x7f)]) + '\0' + '¥'
+
+# The max length of the partial romaji chars which are converted
+# in the middle of the segment.
+_MAX_PARTIAL_LENGTH = 4
+
+def _trie_insert(trie, key, value):
+    node = trie
+    for c in key:
+        node = node.setdefault(c, {})
+    # '' is not a typed char and it's used for the value of the node.
+    node[''] = value
+
+def _trie_match(trie, chars, length):
+    # Walk the trie with chars and return the longest match which is
+    # either the whole chars or not longer than _MAX_PARTIAL_LENGTH.
+    node = trie
+    i = 0
+    match = None
+    for c in chars:
+        node = node.get(c)
+        if node == None:
+            break
+        i += 1
+        value = node.get('')
+        if value != None and (i <= _MAX_PARTIAL_LENGTH or i == length):
+            match = (i, value)
+    return match
+
+def compile_romaji_typing_rule(typing_rule):
+    # Merge typing_rule, symbol_rule, romaji_double_consonat_typing_rule
+    # and romaji_correction_rule_get into one table in the priority order.
+    # The value is (jachars, None) for the typing rules and
+    # (jachars, rest_enchars) for the double consonant and correction rules.
+    rule = {}
+    for k, v in list(romaji_double_consonat_typing_rule.items()):
+        rule[k] = v
+    for k, v in list(symbol_rule.items()):
+        rule[k] = (v, None)
+    for k, v in list(typing_rule.items()):
+        if v:
+            rule[k] = (v, None)
+    chars = set(_CORRECTION_CHARS)
+    for k in list(rule.keys()):
+        chars.update(k)
+    for c in chars:
+        value = romaji_correction_rule_get('n' + c, None)
+        if value != None:
+            rule.setdefault('n' + c, value)
+
+    # append() matches the suffix and prepend() matches the prefix.
+    prefix_trie = {}
+    suffix_trie = {}
+    for k, v in list(rule.items()):
+        _trie_insert(prefix_trie, k, v)
+        _trie_insert(suffix_trie, k[::-1], v)
+    return rule, prefix_trie, suffix_trie
+
 class RomajiSegment(segment.Segment):
+    __slots__ = ('_shift_mode',)
     _prefs = None
     _romaji_typing_rule_method = None
+    _romaji_rule = None
+    _romaji_prefix_trie = None
+    _romaji_suffix_trie = None
     _latin_with_shift = True
-    _shift_mode = False
 
     def __init__(self, enchars='', jachars='', shift=False, unshift=False):
+        if self._romaji_rule == None:
+            self.INIT_ROMAJI_TYPING_RULE(self._prefs)
+        self._shift_mode = False
         if self._latin_with_shift:
             # If Shift key is pressed, Latin mode.
             # If Hiragana_Katakana key is pressed, Hiragana mode.
@@ -50,24 +117,54 @@ class RomajiSegment(segment.Segment):
         enchars = enchars.lower()
 
         if not jachars and not shift:
-            jachars = self.__get_romaji_typing_rule(enchars, None)
-            if jachars == None:
-                jachars = symbol_rule.get(enchars, '')
+            jachars = self.__get_romaji_typing_rule(enchars, '')
         super(RomajiSegment, self).__init__(enchars_orig, jachars)
 
     @classmethod
     def INIT_ROMAJI_TYPING_RULE(cls, prefs):
-        cls._prefs = prefs
-        if prefs == None:
-            cls._romaji_typing_rule_method = None
+        # JaString calls this method whenever the preedit is reset
+        # so compile the tables only when prefs are changed.
+        if cls._romaji_rule != None and cls._prefs == prefs:
             return
-        method = prefs.get_value('romaji-typing-rule', 'method')
-        if method == None:
-            method = 'default'
-        cls._romaji_typing_rule_method = method
-        keymap = prefs.get_value('romaji-typing-rule', 'list')
-        if cls._romaji_typing_rule_method not in keymap.keys():
-            cls._romaji_typing_rule_method = None
+        cls._prefs = prefs
+        cls._romaji_typing_rule_method = None
+        keymap = {}
+        if prefs != None:
+            method = prefs.get_snapshot_value('romaji-typing-rule', 'method')
+            if method == None:
+                method = 'default'
+            keymap = prefs.get_snapshot_value('romaji-typing-rule', 'list')
+            if method in keymap.keys():
+                cls._romaji_typing_rule_method = method
+        method = cls._romaji_typing_rule_method
+        cache_key = None
+        if method != None:
+            cache_key = typingcache.get_key(method,
+                                            sorted(keymap[method].items()))
+            tables = typingcache.load('romaji', cache_key)
+            if tables != None:
+                cls._romaji_rule, cls._romaji_prefix_trie, \
+                    cls._romaji_suffix_trie = tables
+                return
+        typing_rule = romaji_typing_rule_static
+        if method != None:
+            typing_rule = {}
+            for gkey, value in list(keymap[method].items()):
+                key = prefs.typing_from_config_key(gkey)
+                if key == '':
+                    continue
+                typing_rule[key] = value
+        tables = compile_romaji_typing_rule(typing_rule)
+        if cache_key != None:
+            typingcache.save('romaji', cache_key, tables)
+        cls._romaji_rule, cls._romaji_prefix_trie, cls._romaji_suffix_trie = \
+            tables
+
+    @classmethod
+    def RESET(cls, prefs, section, key, value):
+        if section == 'romaji-typing-rule':
+            cls._romaji_rule = None
+            cls.INIT_ROMAJI_TYPING_RULE(prefs)
 
     @classmethod
     def SET_LATIN_WITH_SHIFT(cls, latin_with_shift):
@@ -75,24 +172,10 @@ class RomajiSegment(segment.Segment):
         cls._latin_with_shift = latin_with_shift
 
     def __get_romaji_typing_rule(self, enchars, retval=None):
-        prefs = self._prefs
-        value = None
-        method = self._romaji_typing_rule_method
-        if method != None:
-            # Need to send Unicode to typing_to_config_key instead of UTF-8
-            # not to separate U+A5
-            gkey = prefs.typing_to_config_key(enchars)
-            if gkey == '':
-                return None
-            keymap = prefs.get_value('romaji-typing-rule', 'list')[method]
-            value = keymap.get(gkey)
-            if value == '':
-                value = None
-            if value == None:
-                value = retval 
-        else:
-            value = romaji_typing_rule_static.get(enchars, retval)
-        return value
+        jachars, rest = self._romaji_rule.get(enchars, (None, None))
+        if jachars == None or rest != None:
+            return retval
+        return jachars
 
     def is_finished(self):
         return self._jachars != ''
@@ -121,57 +204,30 @@ class RomajiSegment(segment.Segment):
             self._enchars = text_orig
             return []
 
-        jachars = self.__get_romaji_typing_rule(text, None)
-        if jachars == None:
-            jachars = symbol_rule.get(text, None)
-        if jachars:
+        match = _trie_match(self._romaji_suffix_trie, reversed(text), len(text))
+        if match == None:
             self._enchars = text_orig
-            self._jachars = jachars
             return []
+        length, (jachars, c) = match
 
-        jachars, c = romaji_double_consonat_typing_rule.get(text, (None, None))
-        if jachars:
-            self._enchars = text_orig[0]
-            self._jachars = jachars
-            return [RomajiSegment(c)]
-
-#        jachars, c = romaji_correction_rule.get(text, (None, None))
-        jachars, c = romaji_correction_rule_get(text, (None, None))
-        if jachars:
+        if length == len(text):
+            if c == None:
+                self._enchars = text_orig
+                self._jachars = jachars
+                return []
             self._enchars = text_orig[0]
             self._jachars = jachars
             return [RomajiSegment(c)]
 
-        for i in range(-min(4, len(text)), 0):
-            enchars = text[i:]
-
-            jachars = self.__get_romaji_typing_rule(enchars, None)
-            if jachars == None:
-                jachars = symbol_rule.get(enchars, None)
-            if jachars:
-                jasegment = RomajiSegment(enchars, jachars)
-                self._enchars = text_orig[:i]
-                return [jasegment]
-
-            jachars, c = romaji_double_consonat_typing_rule.get(enchars, (None, None))
-            if jachars:
-                jasegment = RomajiSegment(enchars[:-len(c)], jachars)
-                self._enchars = text_orig[:i]
-                if c:
-                    return [jasegment, RomajiSegment(c)]
-                return [jasegment]
-
-#            jachars, c = romaji_correction_rule.get(enchars, (None, None))
-            jachars, c = romaji_correction_rule_get(enchars, (None, None))
-            if jachars:
-                jasegment = RomajiSegment(enchars[:-len(c)], jachars)
-                self._enchars = text_orig[:i]
-                if c:
-                    return [jasegment, RomajiSegment(c)]
-                return [jasegment]
-
-        self._enchars = text_orig
-        return []
+        i = -length
+        enchars = text[i:]
+        self._enchars = text_orig[:i]
+        if c == None:
+            return [RomajiSegment(enchars, jachars)]
+        jasegment = RomajiSegment(enchars[:-len(c)], jachars)
+        if c:
+            return [jasegment, RomajiSegment(c)]
+        return [jasegment]
 
     def prepend(self, enchar, shift=False, unshift=False):
         if enchar == '' or enchar == '\0':
@@ -196,49 +252,27 @@ class RomajiSegment(segment.Segment):
             self._enchars = text_orig
             return []
 
-        jachars = self.__get_romaji_typing_rule(text, None)
-        if jachars == None:
-            jachars = symbol_rule.get(text, None)
-        if jachars:
+        match = _trie_match(self._romaji_prefix_trie, text, len(text))
+        if match == None:
             self._enchars = text_orig
-            self._jachars = jachars
             return []
+        length, (jachars, c) = match
 
-        jachars, c = romaji_double_consonat_typing_rule.get(text, (None, None))
-        if jachars:
-            self._enchars = c
-            return [RomajiSegment(text_orig[0], jachars)]
-
-#        jachars, c = romaji_correction_rule.get(text, (None, None))
-        jachars, c = romaji_correction_rule_get(text, (None, None))
-        if jachars:
+        if length == len(text):
+            if c == None:
+                self._enchars = text_orig
+                self._jachars = jachars
+                return []
             self._enchars = c
             return [RomajiSegment(text_orig[0], jachars)]
 
-        for i in range(min(4, len(text)), 0, -1):
-            enchars = text[:i]
-
-            jachars = self.__get_romaji_typing_rule(enchars, None)
-            if jachars == None:
-                jachars = symbol_rule.get(enchars, None)
-            if jachars:
-                jasegment = RomajiSegment(enchars, jachars)
-                self._enchars = text_orig[i:]
-                return [jasegment]
-
-            jachars, c = romaji_double_consonat_typing_rule.get(enchars, (None, None))
-            if jachars:
-                self._enchars = c + text_orig[i:]
-                return [RomajiSegment(enchars[:-len(c)], jachars)]
-
-#            jachars, c = romaji_correction_rule.get(enchars, (None, None))
-            jachars, c = romaji_correction_rule_get(enchars, (None, None))
-            if jachars:
-                self._enchars = c + text_orig[i:]
-                return [RomajiSegment(enchars[:-len(c)], jachars)]
-
-        self._enchars = text_orig
-        return []
+        i = length
+        enchars = text[:i]
+        if c == None:
+            self._enchars = text_orig[i:]
+            return [RomajiSegment(enchars, jachars)]
+        self._enchars = c + text_orig[i:]
+        return [RomajiSegment(enchars[:-len(c)], jachars)]
 
     def pop(self, index=-1):
         if index == -1:
@@ -252,9 +286,6 @@ class RomajiSegment(segment.Segment):
             enchars = list(self._enchars)
             del enchars[index]
             self._enchars = ''.join(enchars)
-            jachars = self.__get_romaji_typing_rule(self._enchars, None)
-            if jachars == None:
-                jachars = symbol_rule.get(self._enchars, '')
-            self._jachars = jachars
+            self._jachars = self.__get_romaji_typing_rule(self._enchars, '')
 
 
@@ -28,18 +28,26 @@ _half_full_table = [
     (0x0021, 0xFF01, 0x5E),
 ]
 
-def _h_to_f(c):
-    code = ord (c)
-    for half, full, size in _half_full_table:
-        if code >= half and code < half + size:
-            return chr(full + code - half)
-    return c
+# The full width characters of ASCII
+_half_to_full_table = {}
+for half, full, size in _half_full_table:
+    for i in range(size):
+        _half_to_full_table[chr(half + i)] = chr(full + i)
+_half_to_full_table.update({'"': '\u201d', "'": '\u2019', '`': '\u2018'})
+_half_to_full_trans = str.maketrans(_half_to_full_table)
+
+_katakana_table = str.maketrans(
+    dict([(c, v[0]) for c, v in hiragana_katakana_table.items()]))
+_half_width_katakana_table = str.maketrans(
+    dict([(c, v[1]) for c, v in hiragana_katakana_table.items()]))
 
 def unichar_half_to_full(c):
-    tdl = {'"': '\u201d', "'": '\u2019', '`': '\u2018'}
-    return tdl[c] if c in tdl else _h_to_f(c)
+    return _half_to_full_table.get(c, c)
 
 class Segment(object):
+    # JaString has one segment per typed character.
+    __slots__ = ('_enchars', '_jachars')
+
     def __init__(self, enchars='', jachars=''):
         self._enchars = enchars
         self._jachars = jachars
@@ -57,7 +65,7 @@ class Segment(object):
         raise NotImplementedError('is_finised() is not implemented')
 
     def set_enchars(self, enchars):
-        self.enchars = enchars
+        self._enchars = enchars
 
     def get_enchars(self):
         return self._enchars
@@ -75,21 +83,33 @@ class Segment(object):
 
     def to_katakana(self):
         if self._jachars:
-            return ''.join([hiragana_katakana_table.get(c, (c, c, c))[0] for c in self._jachars])
+            return self._jachars.translate(_katakana_table)
         return self._enchars
 
     def to_half_width_katakana(self):
         if self._jachars:
-            return ''.join([hiragana_katakana_table.get(c, (c, c, c))[1] for c in self._jachars])
+            return self._jachars.translate(_half_width_katakana_table)
         return self._enchars
 
     def to_latin(self):
         return self._enchars
 
     def to_wide_latin(self):
-        return ''.join(map(unichar_half_to_full, self._enchars))
+        return self._enchars.translate(_half_to_full_trans)
 
     def is_empty(self):
         if self._enchars or self._jachars:
             return False
         return True
+
+class ReadingSegment(Segment):
+    # The char of the reading which is already converted, e.g. by anthy
+    # or the clipboard, is finished without the typing rules.
+    __slots__ = ()
+
+    def is_finished(self):
+        return True
+
+    def pop(self, index=-1):
+        self._enchars = ''
+        self._jachars = ''
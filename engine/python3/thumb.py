@@ -24,9 +24,12 @@
 
 __all__ = (
         'ThumbShiftKeyboard',
+        'ThumbShiftLookup',
         'ThumbShiftSegment',
     )
 
+from collections import namedtuple
+import os
 import sys
 
 from gi import require_version as gi_require_version
@@ -37,6 +40,7 @@ from gi.repository import GLib
 from gi.repository import IBus
 
 import segment
+import typingcache
 
 _THUMB_BASIC_METHOD = 'base'
 
@@ -218,6 +222,41 @@ kana_voiced_consonant_rule = {
 
 _UNFINISHED_HIRAGANA = set('かきくけこさしすせそたちつてとはひふへほ')
 
+# The last keymap of the snapshot and the converted rule
+_thumb_typing_rule_last = (None, None)
+
+# Return the (char, value) list of the thumb typing rule method
+# whose gsettings keys are converted to the typed chars.
+def _get_thumb_typing_rule(prefs, method):
+    global _thumb_typing_rule_last
+    keymap = prefs.get_snapshot_value('thumb-typing-rule', 'list')[method]
+    if _thumb_typing_rule_last[0] is keymap:
+        return _thumb_typing_rule_last[1]
+    cache_key = typingcache.get_key(method, sorted(keymap.items()))
+    rule = typingcache.load('thumb', cache_key)
+    if rule == None:
+        rule = []
+        for k in keymap.keys():
+            ch = prefs.typing_from_config_key(k)
+            if ch == '':
+                continue
+            rule.append((ch, keymap.get(k)))
+        typingcache.save('thumb', cache_key, rule)
+    _thumb_typing_rule_last = (keymap, rule)
+    return rule
+
+# The snapshot of ThumbShiftKeyboard for the key events.
+# table has the (no shift, right shift, left shift) chars by keyval and
+# shift_keys has the (0, RS, LS) keyvals by the shift index
+# and thumb_keys has (RS, LS).
+ThumbShiftLookup = namedtuple('ThumbShiftLookup', ['table',
+                                                   'shift_table',
+                                                   'rs',
+                                                   'shift_keys',
+                                                   'thumb_keys',
+                                                   't1',
+                                                   't2'])
+
 class ThumbShiftKeyboard:
     def __init__(self, prefs=None):
         self.__prefs = prefs
@@ -232,6 +271,11 @@ class ThumbShiftKeyboard:
         self.__fmv_extension = 2
         self.__handakuten = False
         self.__thumb_typing_rule_method = None
+        # The layout detected by setxkbmap is used until setxkbmap
+        # detects it again in reset() or invalidate_xkb_layout() is called.
+        self.__xkb_layout = None
+        self.__xkb_layout_pid = None
+        self.__lookup = None
         self.__init_thumb_typing_rule()
         self.__init_layout_table()
         if self.__prefs != None:
@@ -243,11 +287,11 @@ class ThumbShiftKeyboard:
         if prefs == None:
             self.__thumb_typing_rule_method = None
             return
-        method = prefs.get_value('thumb-typing-rule', 'method')
+        method = prefs.get_snapshot_value('thumb-typing-rule', 'method')
         if method == None:
             method = _THUMB_BASIC_METHOD
         self.__thumb_typing_rule_method = method
-        keymap = prefs.get_value('thumb-typing-rule', 'list')
+        keymap = prefs.get_snapshot_value('thumb-typing-rule', 'list')
         if self.__thumb_typing_rule_method not in keymap.keys():
             self.__thumb_typing_rule_method = None
 
@@ -258,13 +302,7 @@ class ThumbShiftKeyboard:
             self.__r_table.clear()
         method = self.__thumb_typing_rule_method
         if method != None:
-            prefs = self.__prefs
-            keymap = prefs.get_value('thumb-typing-rule', 'list')[method]
-            for k in keymap.keys():
-                value = keymap.get(k)
-                ch = prefs.typing_from_config_key(k)
-                if ch == '':
-                    continue
+            for ch, value in _get_thumb_typing_rule(self.__prefs, method):
                 self.__set_bus_table(ch, value)
         else:
             for k in list(_table.keys()):
@@ -304,13 +342,7 @@ class ThumbShiftKeyboard:
             return
         method = self.__thumb_typing_rule_method
         if method != None:
-            prefs = self.__prefs
-            keymap = prefs.get_value('thumb-typing-rule', 'list')[method]
-            for k in keymap.keys():
-                value = keymap.get(k)
-                ch = prefs.typing_from_config_key(k)
-                if ch == '':
-                    continue
+            for ch, value in _get_thumb_typing_rule(self.__prefs, method):
                 self.__set_bus_table(ch, value)
         else:
             for k in list(sub_table.keys()):
@@ -346,6 +378,7 @@ class ThumbShiftKeyboard:
                                       _kb611_f_fmv_table_static)
 
     def __reset_shift_table(self, init):
+        self.__lookup = None
         self.__reset_extension_table(init)
         if self.__handakuten:
             for k in list(_shift_table.keys()):
@@ -417,16 +450,62 @@ class ThumbShiftKeyboard:
         return layout
         '''
 
-        layout = 0
+        if self.__xkb_layout == None:
+            self.__probe_xkb_layout()
+        return self.__xkb_layout
+
+    # setxkbmap runs asynchronously not to block the main loop
+    # and the detected layout is applied when it exits.
+    def __probe_xkb_layout(self):
+        if self.__xkb_layout_pid != None:
+            return
         argv = ['setxkbmap', '-query']
-        (ret, std_out, std_error, exit_status) = \
-                GLib.spawn_sync(None, argv, None,
-                                GLib.SpawnFlags.SEARCH_PATH_FROM_ENVP,
-                                None, None)
-        if not ret:
-            print(std_error.decode('utf-8'), file=sys.stderr)
-            return layout
-        for line in std_out.decode('utf-8').split('\n'):
+        try:
+            (pid, std_in, std_out, std_error) = \
+                GLib.spawn_async(argv,
+                                 flags=GLib.SpawnFlags.SEARCH_PATH |
+                                       GLib.SpawnFlags.DO_NOT_REAP_CHILD,
+                                 standard_output=True,
+                                 standard_error=True)
+        except GLib.Error as e:
+            print(str(e), file=sys.stderr)
+            self.__xkb_layout = 0
+            return
+        self.__xkb_layout_pid = pid
+        GLib.child_watch_add(GLib.PRIORITY_DEFAULT, pid,
+                             self.__on_xkb_layout_probed,
+                             (std_out, std_error))
+
+    def __read_fd(self, fd):
+        data = b''
+        while True:
+            buf = os.read(fd, 4096)
+            if not buf:
+                break
+            data += buf
+        os.close(fd)
+        return data.decode('utf-8')
+
+    def __on_xkb_layout_probed(self, pid, status, fds):
+        std_out, std_error = fds
+        output = self.__read_fd(std_out)
+        error = self.__read_fd(std_error)
+        GLib.spawn_close_pid(pid)
+        if pid != self.__xkb_layout_pid:
+            return
+        self.__xkb_layout_pid = None
+        if os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0:
+            self.__xkb_layout = self.__parse_xkb_layout(output)
+        else:
+            print(error, file=sys.stderr)
+            self.__xkb_layout = 0
+        mode = self.__prefs.get_snapshot_value('thumb', 'keyboard-layout-mode')
+        if mode == 1:
+            self.set_layout(self.__xkb_layout)
+
+    def __parse_xkb_layout(self, output):
+        layout = 0
+        for line in output.split('\n'):
             if line.startswith('layout:'):
                 data = line.split()[1]
                 if data == 'jp':
@@ -442,63 +521,81 @@ class ThumbShiftKeyboard:
         return layout
 
     def __reset_layout_and_handakuten(self):
-        mode = self.__prefs.get_value('thumb', 'keyboard-layout-mode')
+        mode = self.__prefs.get_snapshot_value('thumb', 'keyboard-layout-mode')
         layout = 0
         if mode == 1:
             layout = self.__get_xkb_layout()
+            # Keep the current layout until setxkbmap exits.
+            if layout == None:
+                layout = self.__layout
         else:
-            layout = self.__prefs.get_value('thumb', 'keyboard-layout')
+            layout = self.__prefs.get_snapshot_value('thumb', 'keyboard-layout')
         self.set_layout(layout)
 
-        fmv_extension = self.__prefs.get_value('thumb', 'fmv-extension')
+        fmv_extension = self.__prefs.get_snapshot_value('thumb', 'fmv-extension')
         self.set_fmv_extension(fmv_extension)
-        handakuten = self.__prefs.get_value('thumb', 'handakuten')
+        handakuten = self.__prefs.get_snapshot_value('thumb', 'handakuten')
         self.set_handakuten(handakuten)
 
     def reset(self):
-        s = self.__prefs.get_value('thumb', 'ls')
+        s = self.__prefs.get_snapshot_value('thumb', 'ls')
         ls, state = self.__s_to_key_raw(s)
         if ls == 0xffffff:
             ls = IBus.KEY_Muhenkan
         self.set_ls(ls)
 
-        s = self.__prefs.get_value('thumb', 'rs')
+        s = self.__prefs.get_snapshot_value('thumb', 'rs')
         rs, state = self.__s_to_key_raw(s)
         if rs == 0xffffff:
             rs = IBus.KEY_Henkan
         self.set_rs(rs)
 
-        t1 = self.__prefs.get_value('thumb', 't1')
-        t2 = self.__prefs.get_value('thumb', 't2')
+        t1 = self.__prefs.get_snapshot_value('thumb', 't1')
+        t2 = self.__prefs.get_snapshot_value('thumb', 't2')
         self.set_t1(t1)
         self.set_t2(t2)
 
+        # The layout might be changed with setxkbmap at runtime.
+        mode = self.__prefs.get_snapshot_value('thumb', 'keyboard-layout-mode')
+        if mode == 1 and self.__xkb_layout != None:
+            self.__probe_xkb_layout()
+
         GLib.idle_add(self.__reset_layout_and_handakuten,
                       priority = GLib.PRIORITY_LOW)
 
+    # Detect the layout with setxkbmap again in the next reset()
+    # e.g. after the XKB options are changed.
+    def invalidate_xkb_layout(self):
+        self.__xkb_layout = None
+        self.__xkb_layout_pid = None
+
     def get_ls(self):
         return self.__ls
 
     def set_ls(self, ls):
         self.__ls = ls
+        self.__lookup = None
 
     def get_rs(self):
         return self.__rs
 
     def set_rs(self, rs):
         self.__rs = rs
+        self.__lookup = None
 
     def get_t1(self):
         return self.__t1
 
     def set_t1(self, t1):
         self.__t1 = t1
+        self.__lookup = None
 
     def get_t2(self):
         return self.__t2
 
     def set_t2(self, t2):
         self.__t2 = t2
+        self.__lookup = None
 
     def get_layout(self):
         return self.__layout
@@ -527,6 +624,19 @@ class ThumbShiftKeyboard:
         self.__handakuten = handakuten
         self.__reset_shift_table(True)
 
+    # The lookup is created again after the tables or the keys are reset.
+    def get_lookup(self):
+        if self.__lookup == None:
+            self.__lookup = ThumbShiftLookup(
+                table=dict([(k, tuple(v)) for k, v in self.__table.items()]),
+                shift_table=dict(self.__shift_table),
+                rs=self.__rs,
+                shift_keys=(0, self.__rs, self.__ls),
+                thumb_keys=(self.__rs, self.__ls),
+                t1=self.__t1,
+                t2=self.__t2)
+        return self.__lookup
+
     def get_char(self, key, fallback=None):
         return self.__table.get(key, fallback)
 
@@ -547,6 +657,7 @@ class ThumbShiftKeyboard:
 
 
 class ThumbShiftSegment(segment.Segment):
+    __slots__ = ()
     _prefs = None
     _thumb_typing_rule_section_base = None
     _thumb_typing_rule_section = None
@@ -567,11 +678,11 @@ class ThumbShiftSegment(segment.Segment):
         if prefs == None:
             cls._thumb_typing_rule_section = None
             return
-        method = prefs.get_value('thumb-typing-rule', 'method')
+        method = prefs.get_snapshot_value('thumb-typing-rule', 'method')
         if method == None:
             method = _THUMB_BASIC_METHOD
         cls._thumb_typing_rule_method = method
-        keymap = prefs.get_value('thumb-typing-rule', 'list')
+        keymap = prefs.get_snapshot_value('thumb-typing-rule', 'list')
         if cls._thumb_typing_rule_method not in keymap.keys():
             cls._thumb_typing_rule_method = None
         cls._init_layout_table()
@@ -582,13 +693,7 @@ class ThumbShiftSegment(segment.Segment):
             cls._r_table.clear()
         method = cls._thumb_typing_rule_method
         if method != None:
-            prefs = cls._prefs
-            keymap = prefs.get_value('thumb-typing-rule', 'list')[method]
-            for k in keymap.keys():
-                value = keymap.get(k)
-                ch = prefs.typing_from_config_key(k)
-                if ch == '':
-                    continue
+            for ch, value in _get_thumb_typing_rule(cls._prefs, method):
                 cls._set_bus_table(ch, value)
         else:
             for k in list(_table.keys()):
@@ -0,0 +1,115 @@
+# vim:set et sts=4 sw=4:
+# -*- coding: utf-8 -*-
+#
+# ibus-anthy - The Anthy engine for IBus
+#
+# Copyright (c) 2007-2008 Peng Huang <shawn.p.huang@gmail.com>
+# Copyright (c) 2010-2014 Takao Fujiwara <takao.fujiwara1@gmail.com>
+# Copyright (c) 2007-2014 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# The romaji, kana and thumb shift typing tables which are compiled from
+# the gsettings values are saved under the user cache dir and loaded
+# in the next start of the engine while the gsettings values are not
+# changed.
+
+__all__ = (
+        'get_key',
+        'load',
+        'save',
+    )
+
+import hashlib
+import marshal
+import mmap
+import os
+import sys
+
+from gi import require_version as gi_require_version
+gi_require_version('GLib', '2.0')
+
+from gi.repository import GLib
+
+# Increase the version when the format of the saved tables is changed.
+CACHE_VERSION = 1
+
+_CACHE_DIR = 'ibus-anthy'
+
+# The static tables and the compilers are also a part of the key
+# so the cache is not used after the engine is updated.
+# AnthyPrefs in the setup dir converts the gsettings keys to the typed chars.
+_SOURCE_FILES = ['tables.py', 'romaji.py', 'kana.py', 'thumb.py',
+                 'typingcache.py']
+
+def _get_source_stamp():
+    # The setup dir is added to sys.path by the engine after this module
+    # is imported.
+    import anthyprefs
+    import prefs
+    stamp = []
+    srcdir = os.path.dirname(os.path.abspath(__file__))
+    files = [os.path.join(srcdir, file) for file in _SOURCE_FILES]
+    files.extend([anthyprefs.__file__, prefs.__file__])
+    for file in files:
+        name = os.path.basename(file)
+        try:
+            st = os.stat(file)
+            stamp.append((name, st.st_mtime, st.st_size))
+        except OSError:
+            stamp.append((name, None, None))
+    return tuple(stamp)
+
+_source_stamp = None
+
+def _get_path(name):
+    return os.path.join(GLib.get_user_cache_dir(), _CACHE_DIR,
+                        'typing-%s.cache' % name)
+
+# Return the hash of the gsettings values which the tables are compiled from.
+# The values need to have the stable repr(), e.g. the sorted dict items.
+def get_key(*values):
+    global _source_stamp
+    if _source_stamp == None:
+        _source_stamp = _get_source_stamp()
+    data = repr((CACHE_VERSION, sys.version_info[:2], _source_stamp, values))
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+def load(name, key):
+    try:
+        with open(_get_path(name), 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                version, saved_key, tables = marshal.loads(data)
+    except (OSError, ValueError, EOFError, TypeError):
+        return None
+    if version != CACHE_VERSION or saved_key != key:
+        return None
+    return tables
+
+def save(name, key, tables):
+    path = _get_path(name)
+    tmp_path = '%s.%d' % (path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, 'wb') as f:
+            marshal.dump((CACHE_VERSION, key, tables), f)
+        os.replace(tmp_path, path)
+    except (OSError, ValueError) as e:
+        print('Failed to save the typing table cache %s: %s' % (path, str(e)),
+              file=sys.stderr)
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
@@ -170,6 +170,53 @@ anthy_gcontext_get_segment (AnthyGContext *obj, int nth_seg, int nth_lookup)
     }
 }
 
+gchar **
+anthy_gcontext_get_segments (AnthyGContext *obj, int nth_lookup)
+{
+    struct anthy_conv_stat conv_stat = { 0, };
+    GPtrArray *array;
+    int i;
+    static char temp[512];
+
+    ANTHY_OBJECT_FUNCTION_ASSERTIONS ();
+
+    anthy_get_stat (obj->priv->context, &conv_stat);
+    array = g_ptr_array_sized_new (conv_stat.nr_segment + 1);
+    for (i = 0; i < conv_stat.nr_segment; i++) {
+        if (anthy_get_segment (obj->priv->context, i, nth_lookup,
+                               temp, sizeof (temp)) < 0)
+            break;
+        g_ptr_array_add (array, g_strdup (temp));
+    }
+    g_ptr_array_add (array, NULL);
+    return (gchar **) g_ptr_array_free (array, FALSE);
+}
+
+gchar **
+anthy_gcontext_get_candidates (AnthyGContext *obj, int nth_seg, int start, int n)
+{
+    struct anthy_segment_stat seg_stat = { 0, };
+    GPtrArray *array;
+    int i, end;
+    static char temp[512];
+
+    ANTHY_OBJECT_FUNCTION_ASSERTIONS ();
+
+    anthy_get_segment_stat (obj->priv->context, nth_seg, &seg_stat);
+    end = seg_stat.nr_candidate;
+    if (n >= 0 && start + n < end)
+        end = start + n;
+    array = g_ptr_array_sized_new (MAX (end - start, 0) + 1);
+    for (i = start; i < end; i++) {
+        if (anthy_get_segment (obj->priv->context, nth_seg, i,
+                               temp, sizeof (temp)) < 0)
+            break;
+        g_ptr_array_add (array, g_strdup (temp));
+    }
+    g_ptr_array_add (array, NULL);
+    return (gchar **) g_ptr_array_free (array, FALSE);
+}
+
 int
 anthy_gcontext_commit_segment(AnthyGContext *obj, int nth_seg, int nth_lookup)
 {
@@ -225,6 +272,28 @@ anthy_gcontext_get_prediction (AnthyGContext *obj, int nth_seg)
     }
 }
 
+gchar **
+anthy_gcontext_get_predictions (AnthyGContext *obj)
+{
+    struct anthy_prediction_stat seg_stat = { 0, };
+    GPtrArray *array;
+    int i;
+    static char temp[512];
+
+    ANTHY_OBJECT_FUNCTION_ASSERTIONS ();
+
+    anthy_get_prediction_stat (obj->priv->context, &seg_stat);
+    array = g_ptr_array_sized_new (seg_stat.nr_prediction + 1);
+    for (i = 0; i < seg_stat.nr_prediction; i++) {
+        if (anthy_get_prediction (obj->priv->context, i,
+                                  temp, sizeof (temp)) < 0)
+            break;
+        g_ptr_array_add (array, g_strdup (temp));
+    }
+    g_ptr_array_add (array, NULL);
+    return (gchar **) g_ptr_array_free (array, FALSE);
+}
+
 int
 anthy_gcontext_commit_prediction (AnthyGContext *obj, int nth_seg)
 {
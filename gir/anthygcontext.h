@@ -142,6 +142,33 @@ gchar *         anthy_gcontext_get_segment        (AnthyGContext *obj,
                                                    int           nth_seg,
                                                    int           nth_lookup);
 
+/**
+ * anthy_gcontext_get_segments:
+ * @nth_lookup: Nth lookup
+ * @returns: (transfer full) (array zero-terminated=1): A newly assigned
+ *        string array.
+ *
+ * A newly assigned string array with @nth_lookup of all the segments.
+ */
+gchar **        anthy_gcontext_get_segments       (AnthyGContext *obj,
+                                                   int           nth_lookup);
+
+/**
+ * anthy_gcontext_get_candidates:
+ * @nth_seg: Nth segment
+ * @start: The first candidate
+ * @n: The number of the candidates or -1 for all the rest
+ * @returns: (transfer full) (array zero-terminated=1): A newly assigned
+ *        string array.
+ *
+ * A newly assigned string array with @n candidates of @nth_seg
+ * from @start .
+ */
+gchar **        anthy_gcontext_get_candidates     (AnthyGContext *obj,
+                                                   int           nth_seg,
+                                                   int           start,
+                                                   int           n);
+
 /**
  * anthy_gcontext_commit_segment:
  * @nth_seg: Nth segment
@@ -192,6 +219,15 @@ int             anthy_gcontext_get_nr_predictions
 gchar *         anthy_gcontext_get_prediction    (AnthyGContext *obj,
                                                   int nth_seg);
 
+/**
+ * anthy_gcontext_get_predictions:
+ * @returns: (transfer full) (array zero-terminated=1): A newly assigned
+ *        string array.
+ *
+ * A newly assigned string array of all the predictions.
+ */
+gchar **        anthy_gcontext_get_predictions   (AnthyGContext *obj);
+
 /**
  * anthy_gcontext_commit_prediction:
  * @nth_seg: Nth segment
@@ -7,6 +7,7 @@ main (int argc, char *argv[])
 {
     AnthyGContext *obj = NULL;
     gchar *string = NULL;
+    gchar **strv = NULL;
 
 #if !GLIB_CHECK_VERSION(2,35,0)
     g_type_init ();
@@ -24,11 +25,20 @@ main (int argc, char *argv[])
     printf ("%d\n", anthy_gcontext_get_nr_candidates (obj, 0));
     string = anthy_gcontext_get_segment (obj, 0, 0);
     printf ("%s\n", string ? string : "(null)");
+    strv = anthy_gcontext_get_segments (obj, 0);
+    printf ("%d\n", g_strv_length (strv));
+    g_strfreev (strv);
+    strv = anthy_gcontext_get_candidates (obj, 0, 0, -1);
+    printf ("%d\n", g_strv_length (strv));
+    g_strfreev (strv);
     anthy_gcontext_commit_segment (obj, 0, 0);
     anthy_gcontext_set_prediction_string (obj, "てすと");
     printf ("%d\n", anthy_gcontext_get_nr_predictions (obj));
     string = anthy_gcontext_get_prediction (obj, 0);
     printf ("%s\n", string ? string : "(null)");
+    strv = anthy_gcontext_get_predictions (obj);
+    printf ("%d\n", g_strv_length (strv));
+    g_strfreev (strv);
     anthy_gcontext_commit_prediction (obj, 0);
 
     g_object_unref (obj);
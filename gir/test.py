@@ -11,8 +11,11 @@ anthy.resize_segment(0, -1)
 print anthy.get_nr_segments()
 print anthy.get_nr_candidates(0)
 print anthy.get_segment(0, 0)
+print anthy.get_segments(0)
+print anthy.get_candidates(0, 0, -1)
 print anthy.commit_segment(0, 0)
 anthy.set_prediction_string('てすと')
 print anthy.get_nr_predictions()
 print anthy.get_prediction(0)
+print anthy.get_predictions()
 print anthy.commit_prediction(0)
@@ -196,6 +196,10 @@ class AnthySetup(object):
                    builder.get_object('page-size').get_adjustment(),
                    'value',
                    Gio.SettingsBindFlags.DEFAULT)
+        prefs.bind('common', 'conversion-cache-size',
+                   builder.get_object('conversion-cache-size').get_adjustment(),
+                   'value',
+                   Gio.SettingsBindFlags.DEFAULT)
 
         tv = builder.get_object('shortcut')
         tv.append_column(Gtk.TreeViewColumn(_("Command"),
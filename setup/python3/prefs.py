@@ -22,6 +22,7 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
 import sys
+from types import MappingProxyType
 
 from gi import require_version as gi_require_version
 gi_require_version('Gio', '2.0')
@@ -84,6 +85,14 @@ class DictItem():
         builder.add_value(GLib.Variant.new_string(dict_item.encoding))
         return builder.end()
 
+def _freeze(value):
+    if type(value) == dict:
+        return MappingProxyType(dict([(k, _freeze(v))
+                                      for k, v in value.items()]))
+    if type(value) == list:
+        return tuple([_freeze(v) for v in value])
+    return value
+
 class Prefs(GObject.GObject):
     __gsignals__ = {
         'changed' : (
@@ -95,6 +104,7 @@ class Prefs(GObject.GObject):
     def __init__(self):
         super(Prefs, self).__init__()
         self.__cache = {}
+        self.__snapshot = {}
         self.__settings = {}
         self.__schema_prefix = 'org.freedesktop.ibus.engine.anthy.'
         self.__schema_sections = ['common',
@@ -109,6 +119,12 @@ class Prefs(GObject.GObject):
                     schema=self.__schema_prefix + section)
             self.__settings[section].connect('changed',
                                              self.__settings_on_changed)
+        for section in self.__schema_sections:
+            schema = self.__settings[section].props.settings_schema
+            snapshot = {}
+            for key in schema.list_keys():
+                snapshot[key] = _freeze(self.get_value(section, key))
+            self.__snapshot[section] = MappingProxyType(snapshot)
 
     def __settings_on_changed(self, settings, key):
         section = settings.props.schema[len(self.__schema_prefix):]
@@ -118,6 +134,11 @@ class Prefs(GObject.GObject):
             variant_key = {}
         variant_key[key] = variant_value
         self.__cache[section] = variant_key
+        # The snapshot is immutable and replaced before the signal
+        # so that the handlers read the new value.
+        snapshot = dict(self.__snapshot.get(section, {}))
+        snapshot[key] = _freeze(self.get_value(section, key))
+        self.__snapshot[section] = MappingProxyType(snapshot)
         self.emit('changed', section, key, variant_value)
 
     def variant_to_value(self, variant):
@@ -189,6 +210,16 @@ class Prefs(GObject.GObject):
         variant = self.get_variant(section, key)
         return self.get_readable_value(section, key, variant)
 
+    # Return the unpacked value which is shared and read-only.
+    # get_value() is for the callers which modify the returned value.
+    def get_snapshot_value(self, section, key):
+        snapshot = self.__snapshot.get(section)
+        if snapshot != None:
+            value = snapshot.get(key)
+            if value != None:
+                return value
+        return _freeze(self.get_value(section, key))
+
     def get_default_value(self, section, key):
         variant = self.get_default_variant(section, key)
         return self.get_readable_value(section, key, variant)
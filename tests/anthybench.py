@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Keystroke latency benchmark of engine.Engine without a display.
+#
+# The engine is created with a stub IBus bus which has no D-Bus connection
+# and a stub Anthy context so that the numbers show the cost of the engine
+# itself and do not depend on the Anthy dictionary.
+# The key sequences in anthycases.py are replayed in each typing method and
+# p50/p95/p99 latencies are reported per key, per typing method and
+# per preedit length.
+#
+# Run it in the build tree with the compiled gsettings schema like
+# test-build.sh:
+# GSETTINGS_SCHEMA_DIR=$SCHEMA_TMPDIR \
+# IBUS_ANTHY_ENGINE_PATH=$SRCDIR/../engine/python3 \
+# IBUS_ANTHY_SETUP_PATH=$SRCDIR/../setup/python3 \
+# python3 anthybench.py
+
+from __future__ import print_function
+
+import argparse
+import math
+import time
+
+# anthystub sets the memory gsettings backend and the module paths.
+from anthystub import StubBus, install_stub_anthy
+
+from gi.repository import Gio
+from gi.repository import GLib
+from gi.repository import IBus
+
+from anthycases import TestCases
+
+TYPING_MODES = ['Romaji', 'Kana', 'ThumbShift']
+
+
+class Benchmark(object):
+    ENGINE_PATH = '/com/redhat/IBus/engines/Anthy/Bench/Engine'
+
+    def __init__(self, repeat):
+        install_stub_anthy()
+        import engine
+
+        bench = self
+
+        class BenchEngine(engine.Engine):
+            def update_preedit(self, string, attrs, cursor_pos, visible):
+                bench.preedit_length = len(string)
+                super(BenchEngine, self).update_preedit(string, attrs,
+                                                        cursor_pos, visible)
+
+        # Update the preedit in the idle of each key event to measure it
+        # instead of the update interval.
+        Gio.Settings(schema='org.freedesktop.ibus.engine.anthy.common') \
+            .set_int('update-interval', 0)
+        engine.Engine.CONFIG_RELOADED()
+        self.__engine_class = BenchEngine
+        self.__repeat = repeat
+        self.__id = 0
+        self.preedit_length = 0
+        self.by_key = {}
+        self.by_length = {}
+
+    def __flush(self):
+        context = GLib.MainContext.default()
+        while context.pending():
+            context.iteration(False)
+
+    def __typing(self, mode, keyval, keycode, modifiers):
+        length = self.preedit_length
+        start = time.perf_counter()
+        self.__engine.emit('process-key-event', keyval, keycode, modifiers)
+        # The preedit is updated in the idle.
+        self.__flush()
+        elapsed = time.perf_counter() - start
+        modifiers |= IBus.ModifierType.RELEASE_MASK
+        self.__engine.emit('process-key-event', keyval, keycode, modifiers)
+        self.__flush()
+
+        name = IBus.keyval_name(keyval)
+        if modifiers & IBus.ModifierType.SHIFT_MASK:
+            name = 'Shift+' + name
+        if modifiers & IBus.ModifierType.CONTROL_MASK:
+            name = 'Ctrl+' + name
+        self.by_key.setdefault((mode, name), []).append(elapsed)
+        self.by_length.setdefault((mode, length), []).append(elapsed)
+
+    def __run_cases(self, mode, cases):
+        type = list(cases.keys())[0]
+        if type == 'string':
+            for a in cases['string']:
+                self.__typing(mode, ord(a), 0, 0)
+        if type == 'keys':
+            for key in cases['keys']:
+                self.__typing(mode, key[0], key[1], key[2])
+
+    def run(self, mode):
+        self.__id += 1
+        self.__engine = self.__engine_class(StubBus(),
+                                            '%s/%d' % (self.ENGINE_PATH,
+                                                       self.__id))
+        self.__engine.do_property_activate('InputMode.Hiragana',
+                                           IBus.PropState.CHECKED)
+        self.__engine.do_property_activate('TypingMode.' + mode,
+                                           IBus.PropState.CHECKED)
+        for i in range(self.__repeat):
+            for tests in TestCases['tests']:
+                self.preedit_length = 0
+                self.__run_cases(mode, tests['preedit'])
+                self.__run_cases(mode, tests['conversion'])
+                self.__run_cases(mode, tests['commit'])
+        self.__engine.destroy()
+
+
+def percentile(values, p):
+    # nearest-rank method
+    return values[max(int(math.ceil(p / 100.0 * len(values))) - 1, 0)]
+
+def print_table(title, results):
+    print('%-32s %7s %9s %9s %9s' % (title, 'count', 'p50(ms)', 'p95(ms)',
+                                     'p99(ms)'))
+    for (mode, key) in sorted(results.keys()):
+        values = sorted(results[(mode, key)])
+        print('%-32s %7d %9.3f %9.3f %9.3f' % \
+              ('%s %s' % (mode, key), len(values),
+               percentile(values, 50) * 1000,
+               percentile(values, 95) * 1000,
+               percentile(values, 99) * 1000))
+    print('')
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--repeat', type=int, default=20,
+                        help='replay the test cases REPEAT times per mode')
+    parser.add_argument('-m', '--mode', action='append',
+                        choices=TYPING_MODES,
+                        help='typing method to be measured. ' \
+                             'All the methods by default')
+    args = parser.parse_args()
+
+    IBus.init()
+    benchmark = Benchmark(args.repeat)
+    modes = args.mode if args.mode else TYPING_MODES
+    by_mode = {}
+    for mode in modes:
+        benchmark.run(mode)
+    for (mode, key), values in benchmark.by_key.items():
+        by_mode.setdefault((mode, 'all'), []).extend(values)
+    print_table('mode', by_mode)
+    print_table('mode key', benchmark.by_key)
+    print_table('mode preedit-length', benchmark.by_length)
+
+if __name__ == '__main__':
+    main()
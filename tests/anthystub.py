@@ -0,0 +1,143 @@
+# vim:set et sts=4 sw=4:
+# -*- coding: utf-8 -*-
+
+# The stubs of the IBus bus and the Anthy context to run engine.Engine
+# without ibus-daemon, a display and the Anthy dictionary.
+# anthybench.py and anthyunittest.py import this module before the engine.
+#
+# StubGContext splits the reading into the segments of 3 chars and
+# the n-th candidate of a segment is the reading + str(n).
+
+import os
+import sys
+import types
+
+# Do not change the user settings.
+if 'GSETTINGS_BACKEND' not in os.environ:
+    os.environ['GSETTINGS_BACKEND'] = 'memory'
+
+import gi
+from gi import require_version as gi_require_version
+gi_require_version('Gio', '2.0')
+gi_require_version('GLib', '2.0')
+gi_require_version('IBus', '1.0')
+
+if 'IBUS_ANTHY_ENGINE_PATH' in os.environ:
+    engine_path = os.environ['IBUS_ANTHY_ENGINE_PATH']
+    if engine_path != None and engine_path != '':
+        sys.path.append(engine_path)
+if 'IBUS_ANTHY_SETUP_PATH' in os.environ:
+    setup_path = os.environ['IBUS_ANTHY_SETUP_PATH']
+    if setup_path != None and setup_path != '':
+        sys.path.append(setup_path)
+sys.path.append('/usr/share/ibus-anthy/engine')
+
+
+class StubGContext(object):
+    NR_CANDIDATES = 50
+    NR_PREDICTIONS = 5
+
+    def __init__(self):
+        self.__segments = []
+        self.__prediction = ''
+        # The strings of set_string() for the tests.
+        self.set_strings = []
+
+    @staticmethod
+    def set_logger(level):
+        pass
+
+    def set_encoding(self, encoding):
+        pass
+
+    def init_personality(self):
+        pass
+
+    def do_set_personality(self, name):
+        return 0
+
+    def set_string(self, string):
+        self.set_strings.append(string)
+        self.__segments = [string[i:i + 3] for i in range(0, len(string), 3)]
+        return 0
+
+    def get_nr_segments(self):
+        return len(self.__segments)
+
+    def resize_segment(self, nth, resize):
+        if nth >= len(self.__segments):
+            return
+        text = ''.join(self.__segments[nth:])
+        length = min(max(len(self.__segments[nth]) + resize, 1), len(text))
+        rest = text[length:]
+        self.__segments[nth:] = [text[:length]] + \
+            [rest[i:i + 3] for i in range(0, len(rest), 3)]
+
+    def get_nr_candidates(self, nth_seg):
+        if nth_seg >= len(self.__segments):
+            return 0
+        return self.NR_CANDIDATES
+
+    def get_segment(self, nth_seg, nth_lookup):
+        if nth_seg >= len(self.__segments):
+            return None
+        reading = self.__segments[nth_seg]
+        if nth_lookup <= 0:
+            return reading
+        return '%s%d' % (reading, nth_lookup)
+
+    def get_segments(self, nth_lookup):
+        return [self.get_segment(i, nth_lookup)
+                for i in range(len(self.__segments))]
+
+    def get_candidates(self, nth_seg, start, n):
+        end = self.get_nr_candidates(nth_seg)
+        if n >= 0:
+            end = min(end, start + n)
+        return [self.get_segment(nth_seg, i) for i in range(start, end)]
+
+    def commit_segment(self, nth_seg, nth_lookup):
+        return 0
+
+    def set_prediction_string(self, string):
+        self.__prediction = string
+        return 0
+
+    def get_nr_predictions(self):
+        return self.NR_PREDICTIONS if self.__prediction != '' else 0
+
+    def get_prediction(self, n):
+        return '%s%d' % (self.__prediction, n)
+
+    def get_predictions(self):
+        return [self.get_prediction(i)
+                for i in range(self.get_nr_predictions())]
+
+    def commit_prediction(self, n):
+        return 0
+
+
+def install_stub_anthy():
+    require_version = gi.require_version
+
+    def stub_require_version(namespace, version):
+        if namespace == 'Anthy':
+            return
+        require_version(namespace, version)
+
+    anthy = types.ModuleType('gi.repository.Anthy')
+    anthy.GContext = StubGContext
+    anthy.UTF8_ENCODING = 2
+    anthy.NTH_UNCONVERTED_CANDIDATE = -1
+    anthy.NTH_KATAKANA_CANDIDATE = -2
+    anthy.NTH_HIRAGANA_CANDIDATE = -3
+    anthy.NTH_HALFKANA_CANDIDATE = -4
+    gi.require_version = stub_require_version
+    sys.modules['gi.repository.Anthy'] = anthy
+    import gi.repository
+    gi.repository.Anthy = anthy
+
+
+class StubBus(object):
+    def get_connection(self):
+        return None
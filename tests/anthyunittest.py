@@ -0,0 +1,498 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Unit tests of the engine which run without ibus-daemon, a display and
+# the Anthy dictionary with the stubs in anthystub.py.
+#
+# Run it in the build tree with the compiled gsettings schema like
+# test-build.sh:
+# GSETTINGS_SCHEMA_DIR=$SCHEMA_TMPDIR \
+# IBUS_ANTHY_ENGINE_PATH=$SRCDIR/../engine/python3 \
+# IBUS_ANTHY_SETUP_PATH=$SRCDIR/../setup/python3 \
+# python3 anthyunittest.py
+
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+# Do not change the user cache of the typing tables.
+CACHE_DIR = tempfile.mkdtemp(prefix='ibus-anthy-test-')
+os.environ['XDG_CACHE_HOME'] = CACHE_DIR
+
+# anthystub sets the memory gsettings backend and the module paths.
+from anthystub import StubBus, install_stub_anthy
+
+from gi.repository import Gio
+from gi.repository import GLib
+from gi.repository import IBus
+
+import jastring
+import kana
+import romaji
+import tables
+import typingcache
+
+COMMON_SCHEMA = 'org.freedesktop.ibus.engine.anthy.common'
+THUMB_SCHEMA = 'org.freedesktop.ibus.engine.anthy.thumb'
+
+engine = None
+
+
+def setUpModule():
+    global engine
+    IBus.init()
+    install_stub_anthy()
+    settings = Gio.Settings(schema=COMMON_SCHEMA)
+    settings.set_boolean('show-lut-on-convert', True)
+    settings.set_int('update-interval', 0)
+    import engine
+    # This also sets the prefs of JaString.
+    engine.Engine.CONFIG_RELOADED()
+
+
+def tearDownModule():
+    shutil.rmtree(CACHE_DIR, ignore_errors=True)
+
+
+class JaStringTest(unittest.TestCase):
+    def setUp(self):
+        self.ja_string = jastring.JaString(jastring.TYPING_MODE_ROMAJI)
+        for c in 'kyaka':
+            self.ja_string.insert(c)
+
+    def test_insert(self):
+        self.assertEqual(self.ja_string.get_hiragana(), ('きゃか', 3))
+        self.assertEqual(self.ja_string.get_katakana(), ('キャカ', 3))
+        self.assertEqual(self.ja_string.get_latin(), ('kyaka', 5))
+        self.ja_string.move_cursor(-2)
+        self.ja_string.insert('a')
+        self.assertEqual(self.ja_string.get_hiragana(), ('あきゃか', 1))
+        self.assertEqual(self.ja_string.get_cursor(), 1)
+
+    def test_move_cursor_length(self):
+        # 'きゃ' is one segment so the cursor does not stop in the middle.
+        self.ja_string.move_cursor_hiragana_length(-1)
+        self.assertEqual(self.ja_string.get_hiragana(), ('きゃか', 2))
+        self.ja_string.move_cursor_hiragana_length(-1)
+        self.assertEqual(self.ja_string.get_cursor(), 1)
+        self.ja_string.move_cursor_hiragana_length(-2)
+        self.assertEqual(self.ja_string.get_hiragana(), ('きゃか', 0))
+        self.ja_string.move_cursor_katakana_length(1)
+        self.assertEqual(self.ja_string.get_cursor(), 0)
+        self.ja_string.move_cursor_katakana_length(2)
+        self.assertEqual(self.ja_string.get_katakana(), ('キャカ', 2))
+        self.ja_string.move_cursor_half_with_katakana_length(10)
+        self.assertEqual(self.ja_string.get_cursor(), 2)
+        self.ja_string.move_cursor_hiragana_length(-10)
+        self.assertEqual(self.ja_string.get_cursor(), 0)
+
+    def test_remove_range(self):
+        self.assertTrue(self.ja_string.remove_range(0, 1))
+        self.assertEqual(self.ja_string.get_hiragana(), ('か', 1))
+        self.assertFalse(self.ja_string.remove_range(1, 5))
+        self.ja_string.move_cursor_hiragana_length(-1)
+        self.assertTrue(self.ja_string.remove_range(-1, 5))
+        self.assertTrue(self.ja_string.is_empty())
+        self.assertEqual(self.ja_string.get_cursor(), 0)
+
+    def test_load_reading(self):
+        self.ja_string.move_cursor(-1)
+        self.ja_string.load_reading('あい')
+        self.assertEqual(self.ja_string.get_hiragana(), ('きゃあいか', 4))
+        self.ja_string.move_cursor_hiragana_length(-3)
+        self.assertEqual(self.ja_string.get_cursor(), 1)
+
+    def test_load_reading_kana(self):
+        ja_string = jastring.JaString(jastring.TYPING_MODE_KANA)
+        voiced_marks = [k for k, v in kana.KanaSegment._kana_rule.items()
+                        if v == '゛']
+        if voiced_marks == []:
+            self.skipTest('No voiced mark in the kana typing rule')
+        ja_string.load_reading('かは')
+        # The loaded chars are finished and the voiced mark is a new segment.
+        ja_string.insert(voiced_marks[0])
+        text, cursor = ja_string.get_hiragana()
+        self.assertEqual(text, 'かは゛')
+        self.assertEqual(cursor, 3)
+        self.assertTrue(ja_string.remove_before())
+        self.assertTrue(ja_string.remove_before())
+        self.assertEqual(ja_string.get_hiragana(), ('か', 1))
+
+
+class RomajiRuleTest(unittest.TestCase):
+    def test_compile(self):
+        rule, prefix_trie, suffix_trie = \
+            romaji.compile_romaji_typing_rule(tables.romaji_typing_rule_static)
+        self.assertEqual(rule['ka'], ('か', None))
+        self.assertEqual(rule['kk'], ('っ', 'k'))
+        self.assertEqual(rule['n1'], ('ん', '1'))
+        self.assertEqual(romaji._trie_match(prefix_trie, 'kya', 3),
+                         (3, ('きゃ', None)))
+        self.assertEqual(romaji._trie_match(suffix_trie, reversed('xkya'), 4),
+                         (3, ('きゃ', None)))
+        self.assertEqual(romaji._trie_match(prefix_trie, 'q', 1), None)
+
+    def test_priority(self):
+        # The typing rule overrides the double consonant rule and
+        # the empty values are ignored.
+        rule, prefix_trie, suffix_trie = \
+            romaji.compile_romaji_typing_rule({'kk': 'く', 'ka': ''})
+        self.assertEqual(rule['kk'], ('く', None))
+        self.assertFalse('ka' in rule)
+        self.assertFalse('na' in rule)
+        self.assertEqual(romaji._trie_match(prefix_trie, 'kk', 2),
+                         (2, ('く', None)))
+
+
+class TypingCacheTest(unittest.TestCase):
+    NAME = 'unittest'
+    TABLES = ({'ka': ('か', None)}, {'k': {'a': {'': ('か', None)}}})
+
+    def setUp(self):
+        self.key = typingcache.get_key('default', [('ka', 'か')])
+        self.path = typingcache._get_path(self.NAME)
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_key(self):
+        self.assertEqual(self.key,
+                         typingcache.get_key('default', [('ka', 'か')]))
+        self.assertNotEqual(self.key,
+                            typingcache.get_key('default', [('ka', 'き')]))
+        # The prefs convert the gsettings keys of the typing rules.
+        files = [stamp[0] for stamp in typingcache._source_stamp]
+        self.assertTrue('anthyprefs.py' in files)
+        self.assertTrue('prefs.py' in files)
+
+    def test_save_load(self):
+        self.assertEqual(typingcache.load(self.NAME, self.key), None)
+        typingcache.save(self.NAME, self.key, self.TABLES)
+        self.assertTrue(self.path.startswith(CACHE_DIR))
+        self.assertEqual(typingcache.load(self.NAME, self.key), self.TABLES)
+        other_key = typingcache.get_key('default', [])
+        self.assertEqual(typingcache.load(self.NAME, other_key), None)
+        typingcache.save(self.NAME, other_key, self.TABLES[:1])
+        self.assertEqual(typingcache.load(self.NAME, other_key),
+                         self.TABLES[:1])
+        self.assertEqual(typingcache.load(self.NAME, self.key), None)
+
+    def test_corruption(self):
+        typingcache.save(self.NAME, self.key, self.TABLES)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        for broken in (b'', data[:len(data) // 2], b'\xff' + data[1:]):
+            with open(self.path, 'wb') as f:
+                f.write(broken)
+            self.assertEqual(typingcache.load(self.NAME, self.key), None)
+        with open(self.path, 'wb') as f:
+            f.write(b'garbage')
+        self.assertEqual(typingcache.load(self.NAME, self.key), None)
+        # The broken cache is replaced.
+        typingcache.save(self.NAME, self.key, self.TABLES)
+        self.assertEqual(typingcache.load(self.NAME, self.key), self.TABLES)
+
+
+class ReplaceRuleTest(unittest.TestCase):
+    def test_rule(self):
+        pattern, repl = engine._compile_replace_rule({'ab': ('x',),
+                                                      'abc': ('y',)})
+        self.assertEqual(pattern.sub(repl, 'abcab'), 'yx')
+        self.assertEqual(pattern.subn(repl, 'ac'), ('ac', 0))
+
+    def test_empty_rule(self):
+        pattern, repl = engine._compile_replace_rule({})
+        self.assertEqual(pattern.sub(repl, 'abc'), 'abc')
+        self.assertEqual(pattern.subn(repl, 'abc'), ('abc', 0))
+
+
+class EngineTestCase(unittest.TestCase):
+    ENGINE_PATH = '/com/redhat/IBus/engines/Anthy/UnitTest/Engine'
+    __id = 0
+
+    @classmethod
+    def setUpClass(cls):
+        settings = Gio.Settings(schema=COMMON_SCHEMA)
+        cls.page_size = settings.get_int('page-size')
+
+    def setUp(self):
+        self.engine = self.new_engine()
+
+    def tearDown(self):
+        self.engine.destroy()
+        self.engine = None
+
+    def new_engine(self):
+        EngineTestCase.__id += 1
+        anthy_engine = engine.Engine(StubBus(),
+                                     '%s/%d' % (self.ENGINE_PATH,
+                                                EngineTestCase.__id))
+        anthy_engine.do_property_activate('InputMode.Hiragana',
+                                          IBus.PropState.CHECKED)
+        anthy_engine.do_property_activate('TypingMode.Romaji',
+                                          IBus.PropState.CHECKED)
+        self.committed = []
+        anthy_engine.commit_text = \
+            lambda text: self.committed.append(text.get_text())
+        # The updates which are sent to ibus-daemon.
+        self.updates = []
+        for name, method in (('preedit', 'update_preedit_text'),
+                             ('preedit', 'update_preedit_text_with_mode'),
+                             ('aux', 'update_auxiliary_text'),
+                             ('lookup', 'update_lookup_table')):
+            setattr(anthy_engine, method, self.__record_update(name))
+        return anthy_engine
+
+    def __record_update(self, name):
+        return lambda *args: self.updates.append((name,) + args)
+
+    def get_updates(self, name):
+        return [update[1:] for update in self.updates if update[0] == name]
+
+    def flush(self):
+        context = GLib.MainContext.default()
+        while context.pending():
+            context.iteration(False)
+
+    def typing(self, keyval, state=0):
+        self.engine.emit('process-key-event', keyval, 0, state)
+        self.engine.emit('process-key-event', keyval, 0,
+                         state | IBus.ModifierType.RELEASE_MASK)
+        self.flush()
+
+    def convert(self, string):
+        for c in string:
+            self.typing(ord(c))
+        self.typing(IBus.KEY_space)
+
+    def get_segments(self):
+        return self.engine._Engine__segments
+
+    def get_anthy_context(self):
+        return self.engine._Engine__anthy_context
+
+
+class CandidatePagingTest(EngineTestCase):
+    def test_cursor_down_to_next_page(self):
+        # 'aiu' is one segment of the stub context.
+        self.convert('aiu')
+        for i in range(self.page_size):
+            self.assertTrue(self.engine.do_cursor_down())
+        index = self.page_size * 2 - 1
+        self.assertTrue(
+            self.engine._Engine__on_candidate_index_in_page(self.page_size - 1))
+        self.assertEqual(self.get_segments()[0], (index, 'あいう%d' % index))
+
+
+class ConversionCacheTest(EngineTestCase):
+    def setUp(self):
+        engine.Engine._Engine__clear_convert_cache()
+        super(ConversionCacheTest, self).setUp()
+
+    def test_convert_commit(self):
+        self.convert('aiu')
+        self.assertEqual(self.get_anthy_context().set_strings, ['あいう'])
+        self.typing(IBus.KEY_Return)
+        # The context already has the committed reading.
+        self.assertEqual(self.get_anthy_context().set_strings, ['あいう'])
+        self.assertEqual(self.committed, ['あいう'])
+
+    def test_reconvert_commit(self):
+        self.convert('aiu')
+        self.typing(IBus.KEY_Escape)
+        self.typing(IBus.KEY_space)
+        self.assertEqual(self.get_segments(), [(0, 'あいう')])
+        self.typing(IBus.KEY_Return)
+        self.assertEqual(self.get_anthy_context().set_strings, ['あいう'])
+        self.assertEqual(self.committed, ['あいう'])
+
+    def __convert_in_new_engine(self, string):
+        # The cache is shared by the engines and another engine has
+        # the new anthy context.
+        self.convert(string)
+        self.typing(IBus.KEY_Escape)
+        self.typing(IBus.KEY_Escape)
+        self.engine.destroy()
+        self.engine = self.new_engine()
+        self.convert(string)
+
+    def test_hit_commit(self):
+        self.__convert_in_new_engine('aiu')
+        self.assertEqual(self.get_segments(), [(0, 'あいう')])
+        self.assertEqual(self.get_anthy_context().set_strings, [])
+        self.typing(IBus.KEY_Return)
+        # The deferred reading is set before the segments are committed.
+        self.assertEqual(self.get_anthy_context().set_strings, ['あいう'])
+        self.assertEqual(self.committed, ['あいう'])
+
+    def test_hit_load_candidates(self):
+        self.__convert_in_new_engine('aiu')
+        self.assertEqual(self.get_anthy_context().set_strings, [])
+        for i in range(self.page_size):
+            self.assertTrue(self.engine.do_cursor_down())
+        self.assertEqual(self.get_anthy_context().set_strings, ['あいう'])
+        self.assertEqual(self.get_segments()[0],
+                         (self.page_size, 'あいう%d' % self.page_size))
+
+    def test_disabled(self):
+        settings = Gio.Settings(schema=COMMON_SCHEMA)
+        settings.set_int('conversion-cache-size', 0)
+        self.flush()
+        try:
+            self.__convert_in_new_engine('aiu')
+        finally:
+            settings.reset('conversion-cache-size')
+            self.flush()
+        self.assertEqual(self.get_anthy_context().set_strings, ['あいう'])
+
+
+class UpdateTest(EngineTestCase):
+    def __invalidate(self):
+        self.engine._Engine__invalidate()
+        self.flush()
+
+    def test_same_preedit(self):
+        self.typing(ord('a'))
+        preedits = [update[0].get_text()
+                    for update in self.get_updates('preedit')]
+        self.assertEqual(preedits[-1], 'あ')
+        self.assertEqual(preedits.count('あ'), 1)
+        updates = list(self.updates)
+        self.__invalidate()
+        self.assertEqual(self.updates, updates)
+        # The client might not show the last preedit after the focus in.
+        self.engine.do_focus_in()
+        self.__invalidate()
+        preedits = [update[0].get_text()
+                    for update in self.get_updates('preedit')]
+        self.assertEqual(preedits.count('あ'), 2)
+
+    def test_same_lookup_table(self):
+        self.convert('aiu')
+        lookups = self.get_updates('lookup')
+        self.assertTrue(len(lookups) > 0)
+        self.assertTrue(lookups[-1][1])
+        updates = list(self.updates)
+        self.__invalidate()
+        self.assertEqual(self.updates, updates)
+        self.assertTrue(self.engine.do_cursor_down())
+        self.flush()
+        self.assertEqual(len(self.get_updates('lookup')), len(lookups) + 1)
+        self.assertEqual(self.get_updates('preedit')[-1][0].get_text(),
+                         'あいう1')
+        updates = list(self.updates)
+        self.__invalidate()
+        self.assertEqual(self.updates, updates)
+
+
+class UpdateSchedulerTest(EngineTestCase):
+    def tearDown(self):
+        self.__set_prefs(0, 50)
+        super(UpdateSchedulerTest, self).tearDown()
+
+    def __set_prefs(self, interval, deadline):
+        settings = Gio.Settings(schema=COMMON_SCHEMA)
+        settings.set_int('update-interval', interval)
+        settings.set_int('update-deadline', deadline)
+        self.flush()
+
+    def __invalidate(self):
+        self.engine._Engine__invalidate()
+
+    def __wait_update(self, timeout):
+        # Return the seconds until the next update.
+        context = GLib.MainContext.default()
+        nr_updates = engine.Engine.GET_UPDATE_STATS()[0]
+        start = time.monotonic()
+        while engine.Engine.GET_UPDATE_STATS()[0] == nr_updates:
+            self.assertTrue(time.monotonic() - start < timeout)
+            context.iteration(True)
+        return time.monotonic() - start
+
+    def test_coalesce(self):
+        self.__set_prefs(0, 0)
+        nr_updates, nr_coalesced = engine.Engine.GET_UPDATE_STATS()
+        for i in range(3):
+            self.__invalidate()
+        self.flush()
+        self.assertEqual(engine.Engine.GET_UPDATE_STATS(),
+                         (nr_updates + 1, nr_coalesced + 2))
+
+    def test_interval(self):
+        self.__set_prefs(200, 0)
+        self.__invalidate()
+        self.__wait_update(1)
+        # The next update waits for the interval after the last update.
+        self.__invalidate()
+        self.flush()
+        self.assertNotEqual(self.engine._Engine__idle_id, 0)
+        self.assertTrue(self.__wait_update(1) >= 0.15)
+        self.assertEqual(self.engine._Engine__idle_id, 0)
+
+    def test_deadline(self):
+        self.__set_prefs(0, 100)
+        # The idle of the low priority is starved by the busy source.
+        busy_id = GLib.idle_add(lambda: True)
+        try:
+            self.__invalidate()
+            self.assertTrue(self.__wait_update(1) >= 0.09)
+        finally:
+            GLib.source_remove(busy_id)
+        self.assertEqual(self.engine._Engine__idle_id, 0)
+        self.assertEqual(self.engine._Engine__deadline_id, 0)
+
+
+class ThumbShiftTimerTest(EngineTestCase):
+    def setUp(self):
+        settings = Gio.Settings(schema=THUMB_SCHEMA)
+        settings.set_int('t1', 1000)
+        settings.set_int('t2', 50)
+        self.flush()
+        super(ThumbShiftTimerTest, self).setUp()
+        self.engine.do_property_activate('TypingMode.ThumbShift',
+                                         IBus.PropState.CHECKED)
+        self.flush()
+
+    def tearDown(self):
+        super(ThumbShiftTimerTest, self).tearDown()
+        settings = Gio.Settings(schema=THUMB_SCHEMA)
+        settings.reset('t1')
+        settings.reset('t2')
+        self.flush()
+        engine.Engine._reset_thumb()
+
+    def __key_event(self, keyval, state=0):
+        self.engine.emit('process-key-event', keyval, 0, state)
+        self.flush()
+
+    def test_earlier_deadline(self):
+        lookup = engine.Engine._Engine__thumb.get_lookup()
+        keyvals = [k for k, v in lookup.table.items()
+                   if 0x21 <= k <= 0x7e and v[0]]
+        self.assertTrue(len(keyvals) > 0)
+        # The thumb key arms the timer for T1 and the single keystroke of
+        # the thumb key does not remove the timer.
+        self.__key_event(lookup.rs)
+        self.__key_event(lookup.rs, IBus.ModifierType.RELEASE_MASK)
+        self.assertNotEqual(self.engine._Engine__thumb_timer_id, 0)
+        # The char key is decided after T2 instead of the armed T1.
+        start = time.monotonic()
+        self.__key_event(keyvals[0])
+        context = GLib.MainContext.default()
+        ja_string = lambda: self.engine._Engine__preedit_ja_string
+        while ja_string().is_empty():
+            self.assertTrue(time.monotonic() - start < 0.5)
+            context.iteration(True)
+        self.assertTrue(time.monotonic() - start >= 0.04)
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -126,6 +126,13 @@ run_test_suite()
     export GTK_IM_MODULE=ibus;
 
     for i in 3; do
+        echo "#### Starting Python$i unit test";
+        env IBUS_ANTHY_ENGINE_PATH=$SRCDIR/../engine/python$i          \
+            IBUS_ANTHY_SETUP_PATH=$SRCDIR/../setup/python$i            \
+        python$i -u $SRCDIR/anthyunittest.py;
+        if test $? -ne 0 ; then
+            exit -1;
+        fi;
         echo "#### Starting Python$i API test $RUN_ARGS";
         env IBUS_ANTHY_ENGINE_PATH=$SRCDIR/../engine/python$i          \
             IBUS_ANTHY_SETUP_PATH=$SRCDIR/../setup/python$i            \